@@ -1,17 +1,31 @@
-from flask import Flask
-from flask_migrate import Migrate
+import click
+from flask import Flask, make_response, render_template
 from config import Config
 from app.models import db
-
-migrate = Migrate()
+from app.sharding import create_shard_tables
+from app.schema import add_missing_columns
+from app.serialization import FastJSONProvider
 
 def create_app(config_class=Config):
     app = Flask(__name__)
+    app.json = FastJSONProvider(app)
     app.config.from_object(config_class)
     
     # Initialize extensions
     db.init_app(app)
-    migrate.init_app(app, db)
+    
+    # Migrations are only used by `flask db ...`; web workers skip importing alembic
+    if click.get_current_context(silent=True) is not None:
+        from flask_migrate import Migrate
+        Migrate(app, db)
+    
+    from app import auth, replicas, embedded, events, sweeper, assets
+    auth.init_app(app)
+    replicas.init_app(app)
+    embedded.init_app(app)
+    events.init_app(app)
+    sweeper.init_app(app)
+    assets.init_app(app)
     
     # Register blueprints
     from app.routes import client, staff, admin, super_admin
@@ -24,89 +38,29 @@ def create_app(config_class=Config):
     # Home route
     @app.route('/')
     def index():
-        return '''
-        <html>
-        <head>
-            <title>SmartQ - Queue Management System</title>
-            <style>
-                body {
-                    font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-                    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                    margin: 0;
-                    padding: 0;
-                    display: flex;
-                    justify-content: center;
-                    align-items: center;
-                    min-height: 100vh;
-                }
-                .container {
-                    background: white;
-                    padding: 3rem;
-                    border-radius: 20px;
-                    box-shadow: 0 20px 60px rgba(0,0,0,0.3);
-                    text-align: center;
-                    max-width: 600px;
-                }
-                h1 {
-                    color: #667eea;
-                    margin-bottom: 0.5rem;
-                    font-size: 2.5rem;
-                }
-                .subtitle {
-                    color: #666;
-                    margin-bottom: 2rem;
-                    font-size: 1.1rem;
-                }
-                .links {
-                    display: flex;
-                    flex-direction: column;
-                    gap: 1rem;
-                }
-                a {
-                    display: block;
-                    padding: 1rem 2rem;
-                    background: #667eea;
-                    color: white;
-                    text-decoration: none;
-                    border-radius: 10px;
-                    font-size: 1.1rem;
-                    transition: all 0.3s ease;
-                }
-                a:hover {
-                    background: #764ba2;
-                    transform: translateY(-2px);
-                    box-shadow: 0 5px 15px rgba(0,0,0,0.2);
-                }
-                .version {
-                    margin-top: 2rem;
-                    color: #999;
-                    font-size: 0.9rem;
-                }
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <h1>🎯 SmartQ</h1>
-                <p class="subtitle">Modern Queue Management for Rwanda</p>
-                <div class="links">
-                    <a href="/client">📱 Client Kiosk</a>
-                    <a href="/staff/login">👨‍💼 Staff Dashboard</a>
-                    <a href="/admin/login">⚙️ Admin Panel</a>
-                    <a href="/super-admin/login">⚙️ Super Admin Panel</a>
-                </div>
-                <p class="version">Version 1.0.0 MVP</p>
-            </div>
-        </body>
-        </html>
-        '''
+        response = make_response(render_template('index.html'))
+        response.cache_control.public = True
+        response.cache_control.max_age = 300
+        return response
     
-    # Create tables
-    with app.app_context():
-        db.create_all()
-        create_initial_data()
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create missing tables and the initial super admin"""
+        init_db()
     
     return app
 
+def init_db():
+    """Create missing tables and columns on every database and the initial super admin.
+
+    Run once per deploy (flask init-db) instead of on every worker start.
+    """
+    db.create_all()
+    for column in add_missing_columns(db.engines[None], db.metadata.sorted_tables):
+        print(f"Added {column}")
+    create_shard_tables(db)
+    create_initial_data()
+
 def create_initial_data():
     """Create initial super admin if database is empty"""
     from app.models import User
@@ -0,0 +1,65 @@
+"""Fingerprinted static URLs with long-lived caching.
+
+``url_for('static', filename='css/style.css')`` produces
+``/static/css/style.<hash>.css``, where the hash comes from the file's
+contents. Requests for the current fingerprint are served with a one-year
+immutable Cache-Control header. A changed file gets a new URL, so browsers
+never keep a stale copy.
+"""
+import hashlib
+import os
+import re
+
+from flask import g
+
+_FINGERPRINTED = re.compile(r'^(?P<stem>.+)\.(?P<hash>[0-9a-f]{8})(?P<ext>\.[^./]+)$')
+
+
+def init_app(app):
+    # (filename, mtime) -> short content hash, filled in on first use
+    hashes = {}
+
+    def content_hash(filename):
+        path = os.path.join(app.static_folder, filename)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        key = (filename, mtime)
+        if key not in hashes:
+            with open(path, 'rb') as f:
+                hashes[key] = hashlib.md5(f.read()).hexdigest()[:8]
+        return hashes[key]
+
+    @app.url_defaults
+    def fingerprint_static(endpoint, values):
+        if endpoint != 'static' or 'filename' not in values:
+            return
+        filename = values['filename']
+        digest = content_hash(filename)
+        if digest:
+            stem, ext = os.path.splitext(filename)
+            values['filename'] = f'{stem}.{digest}{ext}'
+
+    @app.url_value_preprocessor
+    def strip_fingerprint(endpoint, values):
+        if endpoint != 'static' or not values:
+            return
+        match = _FINGERPRINTED.match(values['filename'])
+        if not match:
+            return
+        filename = match['stem'] + match['ext']
+        digest = content_hash(filename)
+        if digest:
+            values['filename'] = filename
+            # An old fingerprint still gets the current file, just not cached for long
+            g.immutable_static = digest == match['hash']
+
+    @app.after_request
+    def cache_static(response):
+        if g.get('immutable_static') and response.status_code == 200:
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = app.config.get('STATIC_MAX_AGE', 31536000)
+            response.cache_control.immutable = True
+        return response
@@ -0,0 +1,109 @@
+from collections import namedtuple
+from functools import wraps
+
+from flask import g, session, redirect, url_for
+
+from app.cache import TTLCache
+from app.models import User, Service, Organization
+from app.sharding import set_tenant
+
+# Snapshot of the logged-in user, detached from the DB session so it can be cached
+Principal = namedtuple('Principal', ['id', 'username', 'role', 'organization_id', 'service_id'])
+
+# Per-process caches. Writes made through this process invalidate them directly;
+# changes made by other workers are picked up once the TTL expires.
+_principals = TTLCache()
+_services = TTLCache()
+_organizations = TTLCache()
+
+
+def init_app(app):
+    """Apply the configured cache lifetime"""
+    ttl = app.config.get('AUTH_CACHE_TTL', 30)
+    for cache in (_principals, _services, _organizations):
+        cache.ttl = ttl
+        cache.clear()
+
+
+def _load_principal(user_id):
+    user = User.query.get(user_id)
+    if not user:
+        return None
+    return Principal(user.id, user.username, user.role, user.organization_id, user.service_id)
+
+
+def current_principal():
+    """Get the logged-in user, loaded at most once per request"""
+    if 'principal' not in g:
+        user_id = session.get('user_id')
+        g.principal = _principals.get_or_load(user_id, lambda: _load_principal(user_id)) if user_id else None
+    return g.principal
+
+
+def current_service():
+    """Get the principal's service as a dict, or None"""
+    principal = current_principal()
+    if not principal or not principal.service_id:
+        return None
+    return get_service(principal.service_id)
+
+
+def current_organization():
+    """Get the principal's organization as a dict, or None"""
+    principal = current_principal()
+    if not principal or not principal.organization_id:
+        return None
+    return get_organization(principal.organization_id)
+
+
+def get_service(service_id):
+    def load():
+        service = Service.query.get(service_id)
+        return service.to_dict() if service else None
+    return _services.get_or_load(service_id, load)
+
+
+def get_organization(org_id):
+    def load():
+        org = Organization.query.get(org_id)
+        return org.to_dict() if org else None
+    return _organizations.get_or_load(org_id, load)
+
+
+def invalidate_user(user_id):
+    _principals.delete(user_id)
+
+
+def invalidate_service(service_id):
+    _services.delete(service_id)
+
+
+def invalidate_organization(org_id):
+    _organizations.delete(org_id)
+
+
+def role_required(role, login_endpoint):
+    """Build a decorator that only lets users with `role` through.
+
+    The session is re-synced with the stored user, so a deleted account is logged
+    out and a reassigned staff member picks up their new service.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if 'user_id' not in session or session.get('role') != role:
+                return redirect(url_for(login_endpoint))
+
+            principal = current_principal()
+            if not principal or principal.role != role:
+                session.clear()
+                return redirect(url_for(login_endpoint))
+
+            for key in ('organization_id', 'service_id'):
+                value = getattr(principal, key)
+                if key in session and session[key] != value:
+                    session[key] = value
+            set_tenant(principal.organization_id)
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
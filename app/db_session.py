@@ -0,0 +1,24 @@
+from flask_sqlalchemy.session import Session
+
+from app.sharding import is_sharded, current_shard
+from app.replicas import replica_engine
+
+
+class RoutingSession(Session):
+    """Session that picks the database for each query.
+
+    Sharded tables go to the current tenant's database, reads in read-only
+    requests go to a healthy replica, and everything else (including every
+    flush) goes to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and is_sharded(mapper, clause):
+            key = current_shard()
+            if key is not None:
+                return self._db.engines[key]
+        if bind is None and not self._flushing:
+            engine = replica_engine()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
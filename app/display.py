@@ -0,0 +1,115 @@
+"""Shared "now serving" snapshots for display screens.
+
+Each worker keeps one snapshot per organization and shares it between all
+screens polling that organization. At most once per ``DISPLAY_PROBE_INTERVAL``
+it reads the organization's last event number (a one-row lookup). It rebuilds
+the snapshot only when that number moved, or when the snapshot is older than
+``DISPLAY_MAX_AGE`` (service edits don't create events). The database work per
+worker therefore depends on how often the queue changes, not on how many
+screens are watching.
+"""
+import hashlib
+import threading
+import time
+
+import sqlalchemy as sa
+from flask import current_app
+
+from app.models import db, Service, QueueItem, EventSequence
+from app.sharding import set_tenant
+
+FIELDS = ['service_id', 'service_name', 'counter', 'now_serving', 'next', 'waiting']
+
+
+class Snapshot:
+    def __init__(self, seq, rows):
+        self.seq = seq
+        self.rows = rows
+        # Content-based, so every worker hands out the same tag for the same state
+        self.etag = hashlib.md5(repr(rows).encode()).hexdigest()[:16]
+        self.built_at = time.monotonic()
+        self.checked_at = self.built_at
+
+
+_snapshots = {}
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def _lock_for(org_id):
+    with _locks_guard:
+        return _locks.setdefault(org_id, threading.Lock())
+
+
+def _last_seq(org_id):
+    seq = db.session.execute(
+        sa.select(EventSequence.last_seq).where(EventSequence.organization_id == org_id)
+    ).scalar()
+    return seq or 0
+
+
+def _build_rows(org_id):
+    services = db.session.execute(
+        sa.select(Service.id, Service.name, Service.counter_number)
+        .where(Service.organization_id == org_id, Service.is_active == True)
+        .order_by(Service.id)
+    ).all()
+    ids = [s.id for s in services]
+    if not ids:
+        return []
+
+    # One pass over the waiting tickets gives both the count and the next number
+    waiting, next_numbers = {}, {}
+    for service_id, queue_number in db.session.execute(
+        sa.select(QueueItem.service_id, QueueItem.queue_number)
+        .where(QueueItem.service_id.in_(ids), QueueItem.status == 'waiting')
+        .order_by(QueueItem.created_at)
+    ):
+        waiting[service_id] = waiting.get(service_id, 0) + 1
+        next_numbers.setdefault(service_id, queue_number)
+
+    serving = {}
+    for service_id, queue_number in db.session.execute(
+        sa.select(QueueItem.service_id, QueueItem.queue_number)
+        .where(QueueItem.service_id.in_(ids), QueueItem.status == 'serving')
+        .order_by(QueueItem.called_at.desc())
+    ):
+        serving.setdefault(service_id, queue_number)
+
+    return [[s.id, s.name, s.counter_number, serving.get(s.id), next_numbers.get(s.id), waiting.get(s.id, 0)]
+            for s in services]
+
+
+def get_snapshot(org_id):
+    """Get the organization's current snapshot, refreshing it if the queue changed.
+
+    Callers check that the organization exists; snapshots are never evicted otherwise.
+    """
+    config = current_app.config
+    now = time.monotonic()
+    snapshot = _snapshots.get(org_id)
+    if snapshot and now - snapshot.checked_at < config['DISPLAY_PROBE_INTERVAL']:
+        return snapshot
+
+    with _lock_for(org_id):
+        # Another request may have refreshed it while we waited
+        snapshot = _snapshots.get(org_id)
+        if snapshot and now - snapshot.checked_at < config['DISPLAY_PROBE_INTERVAL']:
+            return snapshot
+
+        set_tenant(org_id)
+        seq = _last_seq(org_id)
+        if snapshot and snapshot.seq == seq and now - snapshot.built_at < config['DISPLAY_MAX_AGE']:
+            snapshot.checked_at = now
+            return snapshot
+
+        snapshot = Snapshot(seq, _build_rows(org_id))
+        _snapshots[org_id] = snapshot
+        return snapshot
+
+
+def invalidate(org_id):
+    """Force a rebuild on the next request, e.g. after a service was edited"""
+    _snapshots.pop(org_id, None)
+    with _locks_guard:
+        _locks.pop(org_id, None)
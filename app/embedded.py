@@ -0,0 +1,232 @@
+"""Embedded mode: run on a single SQLite file instead of a MySQL server.
+
+Used when ``SQLALCHEMY_DATABASE_URI`` points at a SQLite file (set
+``DATABASE_BACKEND=sqlite`` or ``DATABASE_URL=sqlite:///path``). Every
+SQLite engine gets:
+
+- WAL journaling and tuned pragmas, so readers never wait for the writer;
+- write transactions that start with ``BEGIN IMMEDIATE`` and queue on a
+  per-process lock, so concurrent requests take turns instead of failing
+  with "database is locked" (other worker processes queue on SQLite's own
+  lock for up to ``SQLITE_BUSY_TIMEOUT`` seconds). In POST/PUT/DELETE
+  requests this happens before the first read, so read-then-write steps
+  such as numbering a new ticket run one request at a time;
+- for ``read_only`` views, a separate pool of query-only connections.
+
+``flask --app run.py sync-central`` (run from cron) keeps the box in step with
+the central MySQL database. It pulls the box's organizations, services and
+staff from central, and pushes new queue events plus the tickets they touched.
+"""
+import os
+import threading
+
+import sqlalchemy as sa
+from flask import current_app, has_request_context, request
+
+from app.models import (db, Organization, Service, User, QueueItem, QueueEvent, EventSequence,
+                        ProjectionCheckpoint)
+from app.sharding import set_tenant
+
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',  # durable at checkpoints; safe with WAL
+    'foreign_keys': 'ON',  # match MySQL
+    'temp_store': 'MEMORY',
+    'cache_size': -32000,  # KiB
+    'mmap_size': 268435456,
+}
+
+_WRITES = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+def is_embedded(url):
+    url = sa.engine.make_url(url)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+class EmbeddedReader:
+    """Query-only connections to the SQLite file, handed to ``read_only`` views"""
+
+    def __init__(self, url, busy_timeout):
+        self.engine = sa.create_engine(url)
+
+        @sa.event.listens_for(self.engine, 'connect')
+        def configure(dbapi_connection, connection_record):
+            _apply_pragmas(dbapi_connection, busy_timeout, query_only=True)
+
+    def pick(self):
+        return self.engine
+
+
+def _apply_pragmas(dbapi_connection, busy_timeout, query_only=False):
+    cursor = dbapi_connection.cursor()
+    for name, value in PRAGMAS.items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+    cursor.execute(f'PRAGMA busy_timeout = {int(busy_timeout * 1000)}')
+    if query_only:
+        cursor.execute('PRAGMA query_only = ON')
+    cursor.close()
+
+
+def _write_request():
+    return has_request_context() and request.method not in ('GET', 'HEAD', 'OPTIONS')
+
+
+def configure_engine(engine, busy_timeout):
+    """Tune a SQLite engine and serialise its writers"""
+    write_lock = threading.Lock()
+
+    def release(info):
+        if info.pop('write_lock', False):
+            write_lock.release()
+
+    @sa.event.listens_for(engine, 'connect')
+    def configure(dbapi_connection, connection_record):
+        _apply_pragmas(dbapi_connection, busy_timeout)
+        # The driver opens a transaction just before the first write; take the write lock right there
+        dbapi_connection.isolation_level = 'IMMEDIATE'
+
+    @sa.event.listens_for(engine, 'before_cursor_execute')
+    def queue_writer(conn, cursor, statement, parameters, context, executemany):
+        if conn.connection.dbapi_connection.in_transaction:
+            return
+        # The last transaction on this connection has ended
+        release(conn.info)
+        is_write = statement.lstrip()[:7].upper().startswith(_WRITES)
+        if not is_write and not _write_request():
+            return
+        # If the lock is held by this thread's other connection, fall back to SQLite's busy wait
+        if write_lock.acquire(timeout=busy_timeout):
+            conn.info['write_lock'] = True
+        if not is_write:
+            # A write request's reads (e.g. counting tickets to number a new one) belong to its
+            # write transaction, or two requests could act on the same read
+            cursor.execute('BEGIN IMMEDIATE')
+
+    @sa.event.listens_for(engine, 'checkin')
+    def release_writer(dbapi_connection, connection_record):
+        if connection_record is not None:
+            release(connection_record.info)
+
+
+def _upsert(conn, table, rows):
+    """Insert or update `rows` (dicts) by the table's single-column primary key"""
+    if not rows:
+        return
+    key = list(table.primary_key.columns)[0]
+    existing = set(conn.execute(sa.select(key).where(key.in_([r[key.name] for r in rows]))).scalars())
+    new = [r for r in rows if r[key.name] not in existing]
+    old = [r for r in rows if r[key.name] in existing]
+    if new:
+        conn.execute(sa.insert(table), new)
+    if old:
+        columns = [c for c in table.columns if c is not key]
+        conn.execute(
+            sa.update(table)
+            .where(key == sa.bindparam('k_' + key.name))
+            .values({c.name: sa.bindparam('v_' + c.name) for c in columns}),
+            [{'k_' + key.name: r[key.name], **{'v_' + c.name: r[c.name] for c in columns}} for r in old]
+        )
+
+
+def pull_reference_data(central, org_ids):
+    """Copy the organizations, their services and their users from the central database"""
+    local = db.session.connection()
+    with central.connect() as conn:
+        for table, column in ((Organization.__table__, 'id'),
+                              (Service.__table__, 'organization_id'),
+                              (User.__table__, 'organization_id')):
+            rows = conn.execute(sa.select(table).where(table.c[column].in_(org_ids))).mappings().all()
+            _upsert(local, table, [dict(row) for row in rows])
+    db.session.commit()
+
+
+def push_queue_data(central, org_id, batch_size):
+    """Send the organization's new events, and the tickets they touched, to the central database.
+
+    Central keeps the box's ticket ids, so each box's queue data needs its own
+    central database (a tenant shard). Returns how many events were sent.
+    """
+    events_table, items_table = QueueEvent.__table__, QueueItem.__table__
+    with central.connect() as conn:
+        sent_seq = conn.execute(
+            sa.select(sa.func.max(events_table.c.seq)).where(events_table.c.organization_id == org_id)
+        ).scalar() or 0
+
+    set_tenant(org_id)
+    sent = 0
+    while True:
+        events = [dict(row) for row in db.session.execute(
+            sa.select(events_table)
+            .where(events_table.c.organization_id == org_id, events_table.c.seq > sent_seq)
+            .order_by(events_table.c.seq)
+            .limit(batch_size)
+        ).mappings()]
+        if not events:
+            break
+        items = [dict(row) for row in db.session.execute(
+            sa.select(items_table).where(items_table.c.id.in_({e['queue_item_id'] for e in events}))
+        ).mappings()]
+        db.session.rollback()
+
+        last = events[-1]['seq']
+        with central.begin() as conn:
+            _upsert(conn, items_table, items)
+            # Central numbers its own rows; (organization_id, seq) identifies the event
+            conn.execute(sa.insert(events_table), [{k: v for k, v in e.items() if k != 'id'} for e in events])
+            _upsert(conn, EventSequence.__table__, [{'organization_id': org_id, 'last_seq': last}])
+            # The box already texted these clients; central mustn't do it again
+            _advance_checkpoint(conn, 'notifications', org_id, last)
+        sent_seq = last
+        sent += len(events)
+    return sent
+
+
+def _advance_checkpoint(conn, name, org_id, seq):
+    table = ProjectionCheckpoint.__table__
+    moved = conn.execute(
+        sa.update(table)
+        .where(table.c.name == name, table.c.organization_id == org_id, table.c.seq < seq)
+        .values(seq=seq)
+    ).rowcount
+    if not moved and conn.execute(
+        sa.select(table.c.seq).where(table.c.name == name, table.c.organization_id == org_id)
+    ).scalar() is None:
+        conn.execute(sa.insert(table).values(name=name, organization_id=org_id, seq=seq))
+
+
+def init_app(app):
+    if not is_embedded(app.config['SQLALCHEMY_DATABASE_URI']):
+        return
+    busy_timeout = app.config.get('SQLITE_BUSY_TIMEOUT', 5)
+    url = sa.engine.make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    os.makedirs(os.path.dirname(os.path.abspath(url.database)), exist_ok=True)
+
+    with app.app_context():
+        for engine in db.engines.values():
+            if is_embedded(engine.url):
+                configure_engine(engine, busy_timeout)
+        # WAL is a property of the file; switch it on before any reader connects
+        with db.engines[None].connect() as conn:
+            conn.exec_driver_sql('SELECT 1')
+    if 'replicas' not in app.extensions:
+        app.extensions['replicas'] = EmbeddedReader(url, busy_timeout)
+
+    @app.cli.command('sync-central')
+    def sync_central_command():
+        """Pull reference data from the central database and push new queue events to it"""
+        config = current_app.config
+        if not config.get('CENTRAL_DATABASE_URL'):
+            raise SystemExit('CENTRAL_DATABASE_URL is not set')
+        central = sa.create_engine(config['CENTRAL_DATABASE_URL'])
+        central_queue = sa.create_engine(config.get('CENTRAL_QUEUE_DATABASE_URL') or config['CENTRAL_DATABASE_URL'])
+        org_ids = config.get('EDGE_ORGANIZATIONS') or \
+            db.session.execute(sa.select(Organization.id)).scalars().all()
+        if not org_ids:
+            raise SystemExit('No organizations to sync; set EDGE_ORGANIZATIONS')
+
+        pull_reference_data(central, org_ids)
+        for org_id in org_ids:
+            sent = push_queue_data(central_queue, org_id, config.get('SYNC_BATCH_SIZE', 500))
+            if sent:
+                print(f"org {org_id}: sent {sent} events")
@@ -0,0 +1,385 @@
+"""Ticket transition log and the projections built from it.
+
+Every status change of a ``QueueItem`` appends a ``QueueEvent`` numbered
+1, 2, 3... per organization, in the same transaction as the change. Handing
+out a number updates that organization's ``EventSequence`` row, which stays
+locked until commit, so numbers are gap-free and committed in order.
+
+Projections read the log from their last checkpoint and apply only the new
+events, so readers never re-scan ``queue_items``.
+"""
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+from sqlalchemy.exc import IntegrityError
+
+from app.models import (db, QueueItem, Service, QueueEvent, EventSequence, ProjectionCheckpoint,
+                        ServiceDailyStats, StaffHourlyStats, StaffServiceTimes, StaffActivity)
+
+# Upper bounds (seconds) of the service time histogram; the last bucket is open-ended
+SERVICE_TIME_BUCKETS = (30, 60, 90, 120, 180, 240, 300, 420, 600, 900, 1200, 1800, 2700, 3600)
+
+
+def _reserve_seqs(org_id, count=1):
+    """Hand out `count` consecutive event numbers, returning the first"""
+    updated = db.session.execute(
+        sa.update(EventSequence)
+        .where(EventSequence.organization_id == org_id)
+        .values(last_seq=EventSequence.last_seq + count)
+    ).rowcount
+    if not updated:
+        try:
+            with db.session.begin_nested():
+                db.session.add(EventSequence(organization_id=org_id, last_seq=count))
+            return 1
+        except IntegrityError:
+            # Another request created the counter first
+            return _reserve_seqs(org_id, count)
+    last = db.session.execute(
+        sa.select(EventSequence.last_seq).where(EventSequence.organization_id == org_id)
+    ).scalar()
+    return last - count + 1
+
+
+def record_transition(item, org_id, from_status, since=None, at=None, to_status=None):
+    """Append an event for `item` moving from `from_status` to `to_status`.
+
+    `to_status` defaults to the item's current status and `since` is when the
+    ticket entered `from_status`. The caller commits.
+    """
+    at = at or datetime.utcnow()
+    if item.id is None:
+        db.session.flush()
+    event = QueueEvent(
+        organization_id=org_id,
+        seq=_reserve_seqs(org_id),
+        queue_item_id=item.id,
+        service_id=item.service_id,
+        from_status=from_status,
+        to_status=to_status or item.status,
+        duration=int((at - since).total_seconds()) if since else None,
+        user_id=item.served_by,
+        created_at=at
+    )
+    db.session.add(event)
+    return event
+
+
+def record_bulk(org_id, transitions, at=None):
+    """Append events for many tickets at once.
+
+    `transitions` holds (item_id, service_id, from_status, to_status, since,
+    user_id) tuples. The caller commits.
+    """
+    if not transitions:
+        return
+    at = at or datetime.utcnow()
+    first = _reserve_seqs(org_id, len(transitions))
+    db.session.execute(sa.insert(QueueEvent), [
+        {
+            'organization_id': org_id,
+            'seq': first + i,
+            'queue_item_id': item_id,
+            'service_id': service_id,
+            'from_status': from_status,
+            'to_status': to_status,
+            'duration': int((at - since).total_seconds()) if since else None,
+            'user_id': user_id,
+            'created_at': at
+        }
+        for i, (item_id, service_id, from_status, to_status, since, user_id) in enumerate(transitions)
+    ])
+
+
+class Projection:
+    """Read model fed from one organization's event log"""
+
+    name = None
+
+    def apply(self, event):
+        raise NotImplementedError
+
+    def after_commit(self, events):
+        """Side effects to run once a batch has been committed"""
+
+
+def catch_up(projection, org_id, batch_size=500):
+    """Apply the events after the projection's checkpoint, returning how many were applied.
+
+    Each batch is claimed by moving the checkpoint with a status-guarded update
+    before it is applied, and the claim and the batch are committed together.
+    A worker that loses the claim to another one rolls back and leaves the batch
+    to it, so two workers never build the same rollup rows. Losing the race is
+    not an error; callers just read what is there.
+    """
+    applied = 0
+    while True:
+        checkpoint = ProjectionCheckpoint.query.filter_by(name=projection.name, organization_id=org_id).first()
+        start = checkpoint.seq if checkpoint else 0
+        events = QueueEvent.query.filter(
+            QueueEvent.organization_id == org_id,
+            QueueEvent.seq > start
+        ).order_by(QueueEvent.seq).limit(batch_size).all()
+        if not events:
+            db.session.commit()
+            return applied
+
+        if checkpoint is None:
+            # Create the checkpoint on its own, so the first batch is claimed like every other.
+            # (A savepoint can't do it: on SQLite, releasing one outside a transaction commits.)
+            try:
+                db.session.add(ProjectionCheckpoint(name=projection.name, organization_id=org_id, seq=0))
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+            continue
+
+        end = events[-1].seq
+        claimed = db.session.execute(
+            sa.update(ProjectionCheckpoint)
+            .where(ProjectionCheckpoint.name == projection.name,
+                   ProjectionCheckpoint.organization_id == org_id,
+                   ProjectionCheckpoint.seq == start)
+            .values(seq=end)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not claimed:
+            db.session.rollback()
+            return applied
+
+        try:
+            for event in events:
+                projection.apply(event)
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return applied
+
+        projection.after_commit(events)
+        applied += len(events)
+        if len(events) < batch_size:
+            return applied
+
+
+class DailyStatsProjection(Projection):
+    """Keeps ServiceDailyStats in step with the log"""
+
+    name = 'daily_stats'
+
+    def __init__(self):
+        self._rows = {}
+
+    def _row(self, event):
+        key = (event.service_id, event.created_at.date())
+        row = self._rows.get(key)
+        if row is None:
+            row = db.session.get(ServiceDailyStats, key)
+            if row is None:
+                row = ServiceDailyStats(service_id=key[0], day=key[1], organization_id=event.organization_id,
+                                        joined=0, called=0, served=0, skipped=0,
+                                        wait_seconds=0, service_seconds=0)
+                db.session.add(row)
+            self._rows[key] = row
+        return row
+
+    def apply(self, event):
+        row = self._row(event)
+        if event.to_status == 'waiting' and event.from_status is None:
+            row.joined += 1
+        elif event.to_status == 'serving':
+            row.called += 1
+            row.wait_seconds += event.duration or 0
+        elif event.to_status == 'done':
+            row.served += 1
+            if event.from_status == 'serving':
+                row.service_seconds += event.duration or 0
+        elif event.to_status == 'skipped':
+            row.skipped += 1
+
+    def after_commit(self, events):
+        self._rows.clear()
+
+
+def service_time_bucket(seconds):
+    """Index of the histogram bucket a service time falls in"""
+    for i, bound in enumerate(SERVICE_TIME_BUCKETS):
+        if seconds < bound:
+            return i
+    return len(SERVICE_TIME_BUCKETS)
+
+
+def histogram_percentile(counts, q):
+    """Estimate the `q` quantile (0-1) from bucket counts, interpolating within the bucket"""
+    total = sum(counts.values())
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for bucket in sorted(counts):
+        count = counts[bucket]
+        if not count:
+            continue
+        if seen + count >= rank:
+            lower = SERVICE_TIME_BUCKETS[bucket - 1] if bucket else 0
+            if bucket >= len(SERVICE_TIME_BUCKETS):
+                return lower
+            return lower + (SERVICE_TIME_BUCKETS[bucket] - lower) * (rank - seen) / count
+        seen += count
+    return SERVICE_TIME_BUCKETS[-1]
+
+
+class StaffStatsProjection(Projection):
+    """Keeps the per-staff hourly rollups in step with the log.
+
+    Service time runs from calling a ticket to closing it. An idle gap runs
+    from closing one ticket to calling the next; gaps longer than
+    ``max_idle`` are breaks, not idle time, and are left out.
+    """
+
+    name = 'staff_stats'
+    max_idle = timedelta(minutes=30)
+
+    def __init__(self):
+        self._rows = {}
+        self._times = {}
+        self._activity = {}
+
+    def _row(self, event, hour):
+        key = (event.user_id, hour)
+        row = self._rows.get(key)
+        if row is None:
+            row = db.session.get(StaffHourlyStats, key)
+            if row is None:
+                row = StaffHourlyStats(user_id=key[0], hour=hour, organization_id=event.organization_id,
+                                       called=0, served=0, skipped=0,
+                                       service_seconds=0, idle_seconds=0, idle_gaps=0)
+                db.session.add(row)
+            self._rows[key] = row
+        return row
+
+    def _add_service_time(self, event, hour):
+        key = (event.user_id, hour, service_time_bucket(event.duration or 0))
+        row = self._times.get(key)
+        if row is None:
+            row = db.session.get(StaffServiceTimes, key)
+            if row is None:
+                row = StaffServiceTimes(user_id=key[0], hour=hour, bucket=key[2], count=0)
+                db.session.add(row)
+            self._times[key] = row
+        row.count += 1
+
+    def _activity_for(self, event):
+        activity = self._activity.get(event.user_id)
+        if activity is None:
+            activity = db.session.get(StaffActivity, event.user_id)
+            if activity is None:
+                activity = StaffActivity(user_id=event.user_id, organization_id=event.organization_id)
+                db.session.add(activity)
+            self._activity[event.user_id] = activity
+        return activity
+
+    def apply(self, event):
+        if event.user_id is None:
+            return
+        hour = event.created_at.replace(minute=0, second=0, microsecond=0)
+        if event.to_status == 'serving':
+            row = self._row(event, hour)
+            row.called += 1
+            activity = self._activity_for(event)
+            if activity.last_finished_at and activity.last_finished_at <= event.created_at:
+                gap = event.created_at - activity.last_finished_at
+                if gap <= self.max_idle:
+                    row.idle_seconds += int(gap.total_seconds())
+                    row.idle_gaps += 1
+            # A gap only counts once, from the ticket that closed it
+            activity.last_finished_at = None
+        elif event.from_status == 'serving' and event.to_status in ('done', 'skipped'):
+            row = self._row(event, hour)
+            if event.to_status == 'done':
+                row.served += 1
+                row.service_seconds += event.duration or 0
+                self._add_service_time(event, hour)
+            else:
+                row.skipped += 1
+            self._activity_for(event).last_finished_at = event.created_at
+
+    def after_commit(self, events):
+        self._rows.clear()
+        self._times.clear()
+        self._activity.clear()
+
+
+class NotificationProjection(Projection):
+    """Texts clients when their ticket is called"""
+
+    name = 'notifications'
+    # Older calls (e.g. from a backfill) are not worth a text any more
+    max_age = timedelta(minutes=10)
+
+    def apply(self, event):
+        pass
+
+    def after_commit(self, events):
+        from app.routes.client import send_sms_mock
+
+        cutoff = datetime.utcnow() - self.max_age
+        called = [e for e in events if e.to_status == 'serving' and e.created_at >= cutoff]
+        if not called:
+            return
+        items = QueueItem.query.filter(QueueItem.id.in_([e.queue_item_id for e in called])).all()
+        services = {s.id: s for s in Service.query.filter(Service.id.in_({i.service_id for i in items})).all()}
+        for item in items:
+            service = services.get(item.service_id)
+            counter = service.counter_number if service else ''
+            send_sms_mock(item.phone_number, f"SmartQ: Ticket {item.queue_number}, please go to counter {counter} now.")
+
+
+PROJECTIONS = [DailyStatsProjection, StaffStatsProjection, NotificationProjection]
+
+
+def init_app(app):
+    @app.cli.command('project-events')
+    def project_events_command():
+        """Bring every projection up to date for every organization"""
+        from app.models import Organization
+        from app.sharding import set_tenant
+
+        for org_id, in db.session.query(Organization.id).all():
+            set_tenant(org_id)
+            for projection in PROJECTIONS:
+                count = catch_up(projection(), org_id)
+                if count:
+                    print(f"org {org_id}: {projection.name} applied {count} events")
+
+    @app.cli.command('backfill-events')
+    def backfill_events_command():
+        """Create events for tickets that were recorded before the event log existed.
+
+        Backfilled events are numbered after any existing ones.
+        """
+        from app.sharding import set_tenant
+
+        for service in Service.query.all():
+            set_tenant(service.organization_id)
+            logged = sa.select(QueueEvent.queue_item_id).where(QueueEvent.service_id == service.id)
+            items = QueueItem.query.filter(
+                QueueItem.service_id == service.id,
+                QueueItem.id.notin_(logged)
+            ).order_by(QueueItem.created_at).all()
+            for item in items:
+                _backfill(item, service.organization_id)
+            db.session.commit()
+            if items:
+                print(f"service {service.id}: backfilled {len(items)} tickets")
+
+
+def _backfill(item, org_id):
+    """Rebuild a ticket's events from its timestamps"""
+    record_transition(item, org_id, None, at=item.created_at, to_status='waiting')
+    if item.called_at:
+        record_transition(item, org_id, 'waiting', since=item.created_at, at=item.called_at, to_status='serving')
+    if item.status in ('done', 'skipped'):
+        # Skips had no timestamp before the log existed
+        record_transition(item, org_id, 'serving' if item.called_at else 'waiting',
+                          since=item.called_at or item.created_at,
+                          at=item.completed_at or item.called_at or item.created_at)
@@ -0,0 +1,79 @@
+"""Idempotent staff actions.
+
+Staff clients send an ``idempotency_key`` with every mutation and reuse it
+when they retry. The response to the first request is stored in
+``staff_actions`` in the same transaction as the change itself. A retry with
+that key gets the stored response back instead of acting a second time, e.g.
+calling two people. The sweeper drops keys after ``STAFF_ACTION_RETENTION``
+hours.
+"""
+from datetime import datetime
+from functools import wraps
+
+from flask import current_app, request, jsonify
+from sqlalchemy.exc import IntegrityError
+
+from app.models import db, StaffAction
+from app.auth import current_principal
+
+# Length of the idempotency_key columns
+MAX_KEY_LENGTH = 64
+
+
+def valid_key(key):
+    return isinstance(key, str) and 0 < len(key) <= MAX_KEY_LENGTH
+
+
+def _replay(key, principal):
+    action = db.session.get(StaffAction, key)
+    if action is None:
+        return None
+    if action.user_id != principal.id or action.endpoint != request.endpoint:
+        return jsonify({'error': 'Idempotency key was already used for another action'}), 422
+    response = current_app.response_class(action.response, status=action.status_code,
+                                          mimetype='application/json')
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(f):
+    """Commit a staff view's changes once, together with its response.
+
+    The view must not commit. An error response (4xx) rolls its changes
+    back, so a request is applied either fully or not at all.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        key = (request.get_json(silent=True) or {}).get('idempotency_key')
+        principal = current_principal()
+        if key:
+            if not valid_key(key):
+                return jsonify({'error': 'Invalid idempotency key'}), 400
+            replayed = _replay(key, principal)
+            if replayed is not None:
+                return replayed
+
+        response = current_app.make_response(f(*args, **kwargs))
+        if response.status_code >= 400:
+            db.session.rollback()
+        if key and response.status_code < 500:
+            db.session.add(StaffAction(
+                idempotency_key=key,
+                organization_id=principal.organization_id,
+                user_id=principal.id,
+                endpoint=request.endpoint,
+                status_code=response.status_code,
+                response=response.get_data(as_text=True),
+                created_at=datetime.utcnow()
+            ))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # A concurrent retry with the same key won the race
+            db.session.rollback()
+            replayed = _replay(key, principal) if key else None
+            if replayed is None:
+                raise
+            return replayed
+        return response
+    return decorated_function
@@ -1,9 +1,10 @@
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
+from app.db_session import RoutingSession
 
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class Organization(db.Model):
     __tablename__ = 'organizations'
@@ -12,6 +13,7 @@ class Organization(db.Model):
     name = db.Column(db.String(200), nullable=False)
     location = db.Column(db.String(200))
     contact = db.Column(db.String(50))
+    timezone = db.Column(db.String(50))  # IANA name, e.g. 'Africa/Kigali'; None uses DEFAULT_TIMEZONE
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
@@ -25,6 +27,7 @@ class Organization(db.Model):
             'name': self.name,
             'location': self.location,
             'contact': self.contact,
+            'timezone': self.timezone,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
@@ -81,6 +84,13 @@ class Service(db.Model):
             'is_active': self.is_active
         }
 
+# Columns matching Service.to_dict(), for row-tuple queries
+SERVICE_COLUMNS = (Service.id, Service.name, Service.organization_id, Service.counter_number,
+                   Service.avg_service_time, Service.is_active)
+
+# Columns matching User.to_dict()
+USER_COLUMNS = (User.id, User.username, User.role, User.organization_id, User.service_id)
+
 class QueueItem(db.Model):
     __tablename__ = 'queue_items'
     
@@ -88,10 +98,12 @@ class QueueItem(db.Model):
     queue_number = db.Column(db.String(20), nullable=False, index=True)
     service_id = db.Column(db.Integer, db.ForeignKey('services.id'), nullable=False)
     phone_number = db.Column(db.String(15), nullable=False)
-    status = db.Column(db.String(20), default='waiting')  # waiting, serving, done, skipped
+    status = db.Column(db.String(20), default='waiting')  # waiting, serving, done, skipped, expired
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     called_at = db.Column(db.DateTime)
     completed_at = db.Column(db.DateTime)
+    idempotency_key = db.Column(db.String(64), unique=True)  # set by kiosks so retries don't duplicate
+    served_by = db.Column(db.Integer)  # id of the staff User who called the ticket
     
     def to_dict(self):
         return {
@@ -103,4 +115,139 @@ class QueueItem(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'called_at': self.called_at.isoformat() if self.called_at else None,
             'completed_at': self.completed_at.isoformat() if self.completed_at else None
-        }
\ No newline at end of file
+        }
+
+# Columns matching QueueItem.to_dict()
+QUEUE_ITEM_COLUMNS = (QueueItem.id, QueueItem.queue_number, QueueItem.service_id, QueueItem.phone_number,
+                      QueueItem.status, QueueItem.created_at, QueueItem.called_at, QueueItem.completed_at)
+
+class QueueEvent(db.Model):
+    """Append-only log of ticket status changes, numbered per organization"""
+    __tablename__ = 'queue_events'
+    __table_args__ = (db.UniqueConstraint('organization_id', 'seq'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    organization_id = db.Column(db.Integer, nullable=False)
+    seq = db.Column(db.Integer, nullable=False)  # 1, 2, 3... per organization
+    queue_item_id = db.Column(db.Integer, nullable=False, index=True)
+    service_id = db.Column(db.Integer, nullable=False)
+    from_status = db.Column(db.String(20))  # None when the ticket is created
+    to_status = db.Column(db.String(20), nullable=False)
+    duration = db.Column(db.Integer)  # seconds spent in from_status
+    user_id = db.Column(db.Integer)  # staff member serving the ticket, once called
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'seq': self.seq,
+            'queue_item_id': self.queue_item_id,
+            'service_id': self.service_id,
+            'from_status': self.from_status,
+            'to_status': self.to_status,
+            'duration': self.duration,
+            'user_id': self.user_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+# Columns matching QueueEvent.to_dict()
+QUEUE_EVENT_COLUMNS = (QueueEvent.seq, QueueEvent.queue_item_id, QueueEvent.service_id, QueueEvent.from_status,
+                       QueueEvent.to_status, QueueEvent.duration, QueueEvent.user_id, QueueEvent.created_at)
+
+class EventSequence(db.Model):
+    """Last event number handed out per organization"""
+    __tablename__ = 'event_sequences'
+    
+    organization_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    last_seq = db.Column(db.Integer, nullable=False, default=0)
+
+class ProjectionCheckpoint(db.Model):
+    """Last event a projection has applied, per organization"""
+    __tablename__ = 'projection_checkpoints'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    organization_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    seq = db.Column(db.Integer, nullable=False, default=0)
+
+class ServiceDailyStats(db.Model):
+    """Per-service daily counters kept up to date from the event log"""
+    __tablename__ = 'service_daily_stats'
+    
+    service_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    day = db.Column(db.Date, primary_key=True)
+    organization_id = db.Column(db.Integer, nullable=False, index=True)
+    joined = db.Column(db.Integer, nullable=False, default=0)
+    called = db.Column(db.Integer, nullable=False, default=0)
+    served = db.Column(db.Integer, nullable=False, default=0)
+    skipped = db.Column(db.Integer, nullable=False, default=0)
+    wait_seconds = db.Column(db.Integer, nullable=False, default=0)  # waiting -> serving, summed over called
+    service_seconds = db.Column(db.Integer, nullable=False, default=0)  # serving -> done, summed over served
+
+class StaffHourlyStats(db.Model):
+    """Per-staff hourly counters kept up to date from the event log"""
+    __tablename__ = 'staff_hourly_stats'
+    
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    hour = db.Column(db.DateTime, primary_key=True)  # UTC, truncated to the hour
+    organization_id = db.Column(db.Integer, nullable=False, index=True)
+    called = db.Column(db.Integer, nullable=False, default=0)
+    served = db.Column(db.Integer, nullable=False, default=0)
+    skipped = db.Column(db.Integer, nullable=False, default=0)
+    service_seconds = db.Column(db.Integer, nullable=False, default=0)  # serving -> done, summed over served
+    idle_seconds = db.Column(db.Integer, nullable=False, default=0)  # finishing one ticket -> calling the next
+    idle_gaps = db.Column(db.Integer, nullable=False, default=0)
+
+class StaffServiceTimes(db.Model):
+    """Histogram of per-staff service times per hour, for percentiles"""
+    __tablename__ = 'staff_service_times'
+    
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    hour = db.Column(db.DateTime, primary_key=True)
+    bucket = db.Column(db.Integer, primary_key=True, autoincrement=False)  # index into SERVICE_TIME_BUCKETS
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class StaffActivity(db.Model):
+    """When each staff member last finished a ticket, to measure idle gaps"""
+    __tablename__ = 'staff_activity'
+    
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    organization_id = db.Column(db.Integer, nullable=False)
+    last_finished_at = db.Column(db.DateTime)
+
+class StaffAction(db.Model):
+    """Response to a staff request, kept so a retry with the same key isn't applied twice"""
+    __tablename__ = 'staff_actions'
+    
+    idempotency_key = db.Column(db.String(64), primary_key=True)
+    organization_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    endpoint = db.Column(db.String(50), nullable=False)
+    status_code = db.Column(db.Integer, nullable=False)
+    response = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class SweepRun(db.Model):
+    """What one run of the stale-ticket sweeper cleaned up for an organization"""
+    __tablename__ = 'sweep_runs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    organization_id = db.Column(db.Integer, nullable=False, index=True)
+    ran_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expired = db.Column(db.Integer, nullable=False, default=0)
+    no_shows = db.Column(db.Integer, nullable=False, default=0)
+    duration_ms = db.Column(db.Integer)
+    
+    def to_dict(self):
+        return {
+            'organization_id': self.organization_id,
+            'ran_at': self.ran_at.isoformat() if self.ran_at else None,
+            'expired': self.expired,
+            'no_shows': self.no_shows,
+            'duration_ms': self.duration_ms
+        }
+
+class ReplicaHeartbeat(db.Model):
+    """Single-row clock written to the primary so replicas can report their lag"""
+    __tablename__ = 'replica_heartbeat'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    beat_at = db.Column(db.Float, nullable=False)  # unix time
@@ -0,0 +1,194 @@
+"""Read-replica routing for read-only endpoints.
+
+Views decorated with ``read_only`` read from one of ``SQLALCHEMY_REPLICAS``
+while it is healthy. A replica is healthy when it answers and the heartbeat
+the primary writes on every check has reached it within ``REPLICA_MAX_LAG``
+seconds. A background thread in each worker checks every
+``REPLICA_CHECK_INTERVAL`` seconds, so requests only read the last result and
+never wait on a slow replica; health that has not been refreshed for a few
+intervals counts as unhealthy. Unhealthy replicas are put back in rotation
+once they catch up. Everything else stays on the primary,
+and a user who just wrote something keeps reading from the primary until
+their write has had time to replicate. In embedded mode the "replica" is a
+query-only connection pool on the same SQLite file (see ``app.embedded``).
+"""
+import itertools
+import os
+import threading
+import time
+from functools import wraps
+
+import sqlalchemy as sa
+from flask import current_app, g, session, has_request_context
+
+# Health older than this many check intervals is not trusted
+STALE_CHECKS = 3
+
+
+class Replica:
+    def __init__(self, name, engine):
+        self.name = name
+        self.engine = engine
+        self.healthy = False
+        self.lag = None
+        self.error = None
+        self.checked_at = None
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'healthy': self.healthy,
+            'lag': self.lag,
+            'error': self.error
+        }
+
+
+class ReplicaRouter:
+    def __init__(self, urls, max_lag=5, check_interval=5, engine_options=None):
+        self.replicas = [Replica(f'replica_{i}', sa.create_engine(url, **(engine_options or {})))
+                         for i, url in enumerate(urls)]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self._prober = None
+
+    def _beat(self, now):
+        """Write a new heartbeat on the primary and return the previous one"""
+        from app.models import db, ReplicaHeartbeat
+        table = ReplicaHeartbeat.__table__
+        with db.engines[None].begin() as conn:
+            previous = conn.execute(sa.select(table.c.beat_at).where(table.c.id == 1)).scalar()
+            if previous is None:
+                conn.execute(sa.insert(table).values(id=1, beat_at=now))
+            else:
+                conn.execute(sa.update(table).where(table.c.id == 1).values(beat_at=now))
+        return previous
+
+    def _check_replica(self, replica, previous, now):
+        from app.models import ReplicaHeartbeat
+        table = ReplicaHeartbeat.__table__
+        try:
+            with replica.engine.connect() as conn:
+                seen = conn.execute(sa.select(table.c.beat_at).where(table.c.id == 1)).scalar()
+        except sa.exc.SQLAlchemyError as e:
+            replica.healthy, replica.lag, replica.error = False, None, str(e.__class__.__name__)
+            return
+        finally:
+            replica.checked_at = time.monotonic()
+
+        replica.error = None
+        if seen is None:
+            replica.healthy, replica.lag = False, None
+            return
+        if previous is None or seen >= previous:
+            # Caught up with the heartbeat written by the last check
+            replica.lag = 0.0
+        else:
+            replica.lag = round(now - seen, 3)
+        replica.healthy = replica.lag <= self.max_lag
+
+    def check(self, now=None):
+        """Refresh the health of every replica"""
+        now = now or time.time()
+        try:
+            previous = self._beat(now)
+        except sa.exc.SQLAlchemyError as e:
+            # Without a fresh heartbeat there is no telling how far behind the replicas are
+            for replica in self.replicas:
+                replica.healthy, replica.lag = False, None
+                replica.error = f'primary: {e.__class__.__name__}'
+                replica.checked_at = time.monotonic()
+            return
+        for replica in self.replicas:
+            self._check_replica(replica, previous, now)
+
+    def _probe(self, app):
+        with app.app_context():
+            while True:
+                try:
+                    self.check()
+                except Exception:
+                    app.logger.exception('Replica health check failed')
+                time.sleep(self.check_interval)
+
+    def _probing(self):
+        # Threads do not survive a fork, so every worker process starts its own
+        return bool(self._prober) and self._prober[0] == os.getpid() and self._prober[1].is_alive()
+
+    def start(self, app):
+        """Start this worker's background health checks, unless they are running"""
+        if self._probing():
+            return
+        with self._lock:
+            if self._probing():
+                return
+            thread = threading.Thread(target=self._probe, args=(app,), name='replica-health', daemon=True)
+            thread.start()
+            self._prober = (os.getpid(), thread)
+
+    def pick(self):
+        """Get the engine of a healthy replica, or None to use the primary"""
+        fresh_after = time.monotonic() - STALE_CHECKS * self.check_interval
+        healthy = [r for r in self.replicas
+                   if r.healthy and r.checked_at is not None and r.checked_at >= fresh_after]
+        if not healthy:
+            return None
+        return healthy[next(self._counter) % len(healthy)].engine
+
+
+def init_app(app):
+    from app.models import db
+
+    urls = app.config.get('SQLALCHEMY_REPLICAS') or []
+    if not urls:
+        return
+    router = app.extensions['replicas'] = ReplicaRouter(
+        urls,
+        max_lag=app.config.get('REPLICA_MAX_LAG', 5),
+        check_interval=app.config.get('REPLICA_CHECK_INTERVAL', 5),
+        engine_options=app.config.get('SQLALCHEMY_ENGINE_OPTIONS')
+    )
+
+    @app.before_request
+    def start_replica_checks():
+        router.start(app)
+
+    @sa.event.listens_for(db.session, 'after_commit')
+    def remember_write(db_session):
+        if has_request_context():
+            g.wrote_primary = True
+
+    @app.after_request
+    def pin_writer_to_primary(response):
+        if g.get('wrote_primary') and 'user_id' in session:
+            session['read_primary_until'] = time.time() + app.config.get('REPLICA_MAX_LAG', 5)
+        return response
+
+    @app.cli.command('replicas')
+    def replicas_command():
+        """Check the read replicas and print their status"""
+        router = app.extensions['replicas']
+        router.check()
+        for replica in router.replicas:
+            print(replica.to_dict())
+
+
+def replica_engine():
+    """Get the replica engine for this request, or None when it must use the primary"""
+    if not has_request_context() or not g.get('read_only'):
+        return None
+    if 'replica_engine' not in g:
+        router = current_app.extensions.get('replicas')
+        g.replica_engine = router.pick() if router else None
+    return g.replica_engine
+
+
+def read_only(f):
+    """Let a view read from a replica"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if session.get('read_primary_until', 0) < time.time():
+            g.read_only = True
+        return f(*args, **kwargs)
+    return decorated_function
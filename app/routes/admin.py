@@ -1,17 +1,18 @@
 from flask import Blueprint, render_template, request, jsonify, session, redirect, url_for
-from app.models import db, User, Service, QueueItem, Organization
-from datetime import datetime, date, timedelta
-from functools import wraps
+from app.models import (db, User, Service, QueueItem, QueueEvent, StaffHourlyStats,
+                        StaffServiceTimes, SERVICE_COLUMNS, USER_COLUMNS, QUEUE_EVENT_COLUMNS)
+from app.serialization import select_rows, rows_response
+from app.display import invalidate as invalidate_display
+from app.events import catch_up, histogram_percentile, StaffStatsProjection
+from app.sweeper import local_zone
+from datetime import datetime, date, time, timedelta, timezone
+from app.replicas import read_only
+from app.auth import (role_required, current_organization, invalidate_user,
+                      invalidate_service)
 
 bp = Blueprint('admin', __name__, url_prefix='/admin')
 
-def admin_required(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if 'user_id' not in session or session.get('role') != 'admin':
-            return redirect(url_for('admin.login'))
-        return f(*args, **kwargs)
-    return decorated_function
+admin_required = role_required('admin', 'admin.login')
 
 @bp.route('/login', methods=['GET', 'POST'])
 def login():
@@ -46,17 +47,16 @@ def dashboard():
 @admin_required
 def get_organization():
     """Get admin's organization info"""
-    org_id = session.get('organization_id')
-    org = Organization.query.get(org_id)
-    return jsonify(org.to_dict() if org else {})
+    return jsonify(current_organization() or {})
 
 @bp.route('/api/services', methods=['GET'])
 @admin_required
+@read_only
 def get_services():
     """Get all services for admin's organization"""
     org_id = session.get('organization_id')
-    services = Service.query.filter_by(organization_id=org_id).all()
-    return jsonify([s.to_dict() for s in services])
+    rows = select_rows(SERVICE_COLUMNS, Service.organization_id == org_id)
+    return rows_response(SERVICE_COLUMNS, rows)
 
 @bp.route('/api/services', methods=['POST'])
 @admin_required
@@ -73,6 +73,7 @@ def create_service():
     )
     db.session.add(service)
     db.session.commit()
+    invalidate_display(org_id)
     return jsonify(service.to_dict())
 
 @bp.route('/api/services/<int:service_id>', methods=['PUT'])
@@ -92,6 +93,8 @@ def update_service(service_id):
     service.is_active = data.get('is_active', service.is_active)
     
     db.session.commit()
+    invalidate_service(service_id)
+    invalidate_display(org_id)
     return jsonify(service.to_dict())
 
 @bp.route('/api/services/<int:service_id>', methods=['DELETE'])
@@ -106,15 +109,18 @@ def delete_service(service_id):
     
     db.session.delete(service)
     db.session.commit()
+    invalidate_service(service_id)
+    invalidate_display(org_id)
     return jsonify({'success': True})
 
 @bp.route('/api/staff', methods=['GET'])
 @admin_required
+@read_only
 def get_staff():
     """Get all staff for admin's organization"""
     org_id = session.get('organization_id')
-    staff = User.query.filter_by(organization_id=org_id, role='staff').all()
-    return jsonify([s.to_dict() for s in staff])
+    rows = select_rows(USER_COLUMNS, User.organization_id == org_id, User.role == 'staff')
+    return rows_response(USER_COLUMNS, rows)
 
 @bp.route('/api/staff', methods=['POST'])
 @admin_required
@@ -156,6 +162,7 @@ def update_staff(staff_id):
         staff.set_password(data['password'])
     
     db.session.commit()
+    invalidate_user(staff_id)
     return jsonify(staff.to_dict())
 
 @bp.route('/api/staff/<int:staff_id>', methods=['DELETE'])
@@ -170,10 +177,12 @@ def delete_staff(staff_id):
     
     db.session.delete(staff)
     db.session.commit()
+    invalidate_user(staff_id)
     return jsonify({'success': True})
 
 @bp.route('/api/analytics', methods=['GET'])
 @admin_required
+@read_only
 def analytics():
     """Get analytics for admin's organization"""
     org_id = session.get('organization_id')
@@ -209,4 +218,110 @@ def analytics():
             'avg_wait_time': avg_wait
         })
     
-    return jsonify(result)
\ No newline at end of file
+    return jsonify(result)
+
+@bp.route('/api/events', methods=['GET'])
+@admin_required
+def get_events():
+    """Get the organization's ticket transitions after a sequence number, for audit and delta sync"""
+    org_id = session.get('organization_id')
+    after = request.args.get('after', 0, type=int)
+    limit = min(request.args.get('limit', 500, type=int), 5000)
+    
+    rows = select_rows(QUEUE_EVENT_COLUMNS,
+                       QueueEvent.organization_id == org_id, QueueEvent.seq > after,
+                       order_by=QueueEvent.seq, limit=limit)
+    return rows_response(QUEUE_EVENT_COLUMNS, rows)
+
+MAX_STAFF_ANALYTICS_DAYS = 90
+MAX_HOURLY_DAYS = 14
+
+@bp.route('/api/staff-analytics', methods=['GET'])
+@admin_required
+def staff_analytics():
+    """Get per-staff throughput, service times and idle gaps as time-bucketed series.
+
+    `bucket` is `hour` or `day` (in the organization's timezone). Series are
+    aligned with `buckets`; a bucket without activity is None.
+    """
+    org_id = session.get('organization_id')
+    bucket = request.args.get('bucket', 'day')
+    days = max(1, min(request.args.get('days', 7, type=int), MAX_STAFF_ANALYTICS_DAYS))
+    if bucket not in ('hour', 'day'):
+        return jsonify({'error': 'bucket must be hour or day'}), 400
+    if bucket == 'hour' and days > MAX_HOURLY_DAYS:
+        return jsonify({'error': f'Hourly series cover at most {MAX_HOURLY_DAYS} days'}), 400
+    
+    tz = local_zone((current_organization() or {}).get('timezone'))
+    now = datetime.utcnow()
+    if bucket == 'hour':
+        start = now.replace(minute=0, second=0, microsecond=0) - timedelta(hours=days * 24 - 1)
+        keys = [start + timedelta(hours=i) for i in range(days * 24)]
+        labels = [k.replace(tzinfo=timezone.utc).astimezone(tz).isoformat() for k in keys]
+        key_for = lambda hour: hour
+    else:
+        today = now.replace(tzinfo=timezone.utc).astimezone(tz).date()
+        keys = [today - timedelta(days=days - 1 - i) for i in range(days)]
+        labels = [k.isoformat() for k in keys]
+        start = datetime.combine(keys[0], time(), tzinfo=tz).astimezone(timezone.utc).replace(tzinfo=None)
+        key_for = lambda hour: hour.replace(tzinfo=timezone.utc).astimezone(tz).date()
+    
+    # Everything below reads the hourly rollups, never the tickets themselves
+    catch_up(StaffStatsProjection(), org_id)
+    totals, buckets = {}, {}
+    for row in StaffHourlyStats.query.filter(StaffHourlyStats.organization_id == org_id,
+                                             StaffHourlyStats.hour >= start):
+        for acc in (_staff_acc(totals, row.user_id), _staff_acc(buckets, (row.user_id, key_for(row.hour)))):
+            acc['active_hours'] += 1
+            for field in ('called', 'served', 'skipped', 'service_seconds', 'idle_seconds', 'idle_gaps'):
+                acc[field] += getattr(row, field)
+    if totals:
+        for row in StaffServiceTimes.query.filter(StaffServiceTimes.user_id.in_(list(totals)),
+                                                  StaffServiceTimes.hour >= start):
+            for acc in (totals[row.user_id], buckets[(row.user_id, key_for(row.hour))]):
+                acc['histogram'][row.bucket] = acc['histogram'].get(row.bucket, 0) + row.count
+    
+    staff = {user_id: (username, service_id) for user_id, username, service_id in db.session.execute(
+        db.select(User.id, User.username, User.service_id)
+        .where(User.organization_id == org_id, User.role == 'staff')
+    )}
+    result = []
+    for user_id in sorted(set(staff) | set(totals)):
+        username, service_id = staff.get(user_id, (None, None))  # None: staff member since deleted
+        series = {}
+        for key in keys:
+            metrics = _staff_metrics(buckets.get((user_id, key)))
+            for name, value in metrics.items():
+                series.setdefault(name, []).append(value)
+        result.append({
+            'user_id': user_id,
+            'username': username,
+            'service_id': service_id,
+            'totals': _staff_metrics(totals.get(user_id)),
+            'series': series
+        })
+    
+    return jsonify({'bucket': bucket, 'timezone': tz.key, 'buckets': labels, 'staff': result})
+
+def _staff_acc(accs, key):
+    if key not in accs:
+        accs[key] = {'active_hours': 0, 'called': 0, 'served': 0, 'skipped': 0, 'service_seconds': 0,
+                     'idle_seconds': 0, 'idle_gaps': 0, 'histogram': {}}
+    return accs[key]
+
+def _staff_metrics(acc):
+    """Turn summed rollups into chartable metrics; times are in minutes"""
+    if not acc:
+        return dict.fromkeys(('served', 'skipped', 'tickets_per_hour', 'avg_service_time', 'p90_service_time',
+                              'avg_idle_gap', 'utilisation'))
+    p90 = histogram_percentile(acc['histogram'], 0.9)
+    busy = acc['service_seconds'] + acc['idle_seconds']
+    return {
+        'served': acc['served'],
+        'skipped': acc['skipped'],
+        'tickets_per_hour': round(acc['served'] / acc['active_hours'], 2),
+        'avg_service_time': round(acc['service_seconds'] / 60 / acc['served'], 1) if acc['served'] else None,
+        'p90_service_time': round(p90 / 60, 1) if p90 is not None else None,
+        'avg_idle_gap': round(acc['idle_seconds'] / 60 / acc['idle_gaps'], 1) if acc['idle_gaps'] else None,
+        'utilisation': round(acc['service_seconds'] / busy, 2) if busy else None
+    }
@@ -1,10 +1,25 @@
-from flask import Blueprint, render_template, request, jsonify
-from app.models import db, Service, QueueItem, Organization
+from flask import Blueprint, render_template, request, jsonify, make_response
+from app.models import db, Service, QueueItem, Organization, SERVICE_COLUMNS
+from app.serialization import select_rows, rows_response
+from app.replicas import read_only
+from app.sharding import set_tenant
+from app.events import record_transition
+from app.auth import get_organization
+from app.display import get_snapshot, FIELDS as DISPLAY_FIELDS
+from app.idempotency import valid_key, MAX_KEY_LENGTH
 from datetime import datetime, date
+from sqlalchemy.exc import IntegrityError
+import hashlib
 import random
 
 bp = Blueprint('client', __name__, url_prefix='/client')
 
+# Largest number of buffered tickets accepted in one sync
+MAX_BATCH_SIZE = 200
+
+# Largest number of organizations one display feed can multiplex
+MAX_FEED_ORGS = 50
+
 def send_sms_mock(phone, message):
     """Mock SMS sending - replace with Twilio in production"""
     print(f"📱 SMS to {phone}: {message}")
@@ -16,20 +31,56 @@ def index():
     return render_template('client.html')
 
 @bp.route('/api/organizations', methods=['GET'])
+@read_only
 def get_organizations():
     """Get all organizations for selection"""
     orgs = Organization.query.all()
     return jsonify([org.to_dict() for org in orgs])
 
 @bp.route('/api/services', methods=['GET'])
+@read_only
 def get_services():
     """Get all active services for an organization"""
     org_id = request.args.get('org_id', type=int)
     if not org_id:
         return jsonify({'error': 'Organization ID required'}), 400
     
-    services = Service.query.filter_by(organization_id=org_id, is_active=True).all()
-    return jsonify([s.to_dict() for s in services])
+    rows = select_rows(SERVICE_COLUMNS, Service.organization_id == org_id, Service.is_active == True)
+    return rows_response(SERVICE_COLUMNS, rows)
+
+def _ticket_info(item, service):
+    """Ticket details shown on the kiosk and sent by SMS"""
+    waiting_ahead = 0
+    if item.status == 'waiting':
+        waiting_ahead = QueueItem.query.filter_by(service_id=item.service_id, status='waiting').filter(
+            QueueItem.created_at < item.created_at
+        ).count()
+    return {
+        'queue_number': item.queue_number,
+        'counter': service.counter_number,
+        'estimated_wait': waiting_ahead * service.avg_service_time,
+        'position': waiting_ahead + 1
+    }
+
+def _issued_at(value):
+    """Parse a kiosk timestamp (epoch milliseconds) so buffered tickets keep their place.
+
+    Timestamps in the future or from before today are ignored.
+    """
+    if not value:
+        return None
+    try:
+        issued = datetime.utcfromtimestamp(float(value) / 1000)
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+    now = datetime.utcnow()
+    if issued > now or issued.date() != now.date():
+        return None
+    return issued
+
+def _send_ticket_sms(phone, service, info):
+    sms_message = f"SmartQ: Your ticket {info['queue_number']} for {service.name}. Counter: {service.counter_number}. Est. wait: {info['estimated_wait']} min."
+    send_sms_mock(phone, sms_message)
 
 @bp.route('/api/join-queue', methods=['POST'])
 def join_queue():
@@ -37,13 +88,23 @@ def join_queue():
     data = request.json
     service_id = data.get('service_id')
     phone = data.get('phone_number')
+    idempotency_key = data.get('idempotency_key')
     
     if not service_id or not phone:
         return jsonify({'error': 'Service and phone number required'}), 400
+    if idempotency_key is not None and not valid_key(idempotency_key):
+        return jsonify({'error': 'Invalid idempotency key'}), 400
     
     service = Service.query.get(service_id)
     if not service:
         return jsonify({'error': 'Service not found'}), 404
+    set_tenant(service.organization_id)
+    
+    # A retried request returns the ticket it already created
+    if idempotency_key:
+        existing = QueueItem.query.filter_by(idempotency_key=idempotency_key).first()
+        if existing:
+            return jsonify({'success': True, 'duplicate': True, **_ticket_info(existing, service)})
     
     # Generate queue number
     today = date.today()
@@ -62,22 +123,133 @@ def join_queue():
         queue_number=queue_number,
         service_id=service_id,
         phone_number=phone,
-        status='waiting'
+        status='waiting',
+        created_at=datetime.utcnow(),
+        idempotency_key=idempotency_key
     )
     db.session.add(queue_item)
-    db.session.commit()
+    try:
+        record_transition(queue_item, service.organization_id, None, at=queue_item.created_at)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        if not idempotency_key:
+            raise
+        # A concurrent retry with the same key won the race
+        existing = QueueItem.query.filter_by(idempotency_key=idempotency_key).first()
+        if not existing:
+            raise
+        return jsonify({'success': True, 'duplicate': True, **_ticket_info(existing, service)})
     
     # Send SMS
-    sms_message = f"SmartQ: Your ticket {queue_number} for {service.name}. Counter: {service.counter_number}. Est. wait: {estimated_wait} min."
-    send_sms_mock(phone, sms_message)
-    
-    return jsonify({
-        'success': True,
+    info = {
         'queue_number': queue_number,
         'counter': service.counter_number,
         'estimated_wait': estimated_wait,
         'position': waiting + 1
-    })
+    }
+    _send_ticket_sms(phone, service, info)
+    
+    return jsonify({'success': True, **info})
+
+@bp.route('/api/join-queue/batch', methods=['POST'])
+def join_queue_batch():
+    """Add tickets buffered by an offline kiosk in one transaction.
+
+    Every ticket needs an idempotency key; tickets already synced are returned
+    as duplicates instead of being created again. All services must belong to
+    the same organization.
+    """
+    data = request.json or {}
+    tickets = data.get('tickets') or []
+    
+    if not tickets:
+        return jsonify({'error': 'Tickets required'}), 400
+    if len(tickets) > MAX_BATCH_SIZE:
+        return jsonify({'error': f'At most {MAX_BATCH_SIZE} tickets per batch'}), 400
+    if any(not isinstance(t, dict) or not valid_key(t.get('idempotency_key')) for t in tickets):
+        return jsonify({'error': f'Every ticket needs an idempotency key of at most {MAX_KEY_LENGTH} characters'}), 400
+    
+    service_ids = {t.get('service_id') for t in tickets if t.get('service_id')}
+    services = {s.id: s for s in Service.query.filter(Service.id.in_(service_ids)).all()}
+    org_ids = {s.organization_id for s in services.values()}
+    if len(org_ids) > 1:
+        return jsonify({'error': 'All tickets must be for one organization'}), 400
+    if org_ids:
+        set_tenant(org_ids.pop())
+    
+    keys = [t['idempotency_key'] for t in tickets]
+    existing = {item.idempotency_key: item
+                for item in QueueItem.query.filter(QueueItem.idempotency_key.in_(keys)).all()}
+    
+    # Today's ticket count and current waiting count per service, updated as tickets are added
+    today = date.today()
+    counts = dict(db.session.query(QueueItem.service_id, db.func.count(QueueItem.id)).filter(
+        QueueItem.service_id.in_(services.keys()),
+        db.func.date(QueueItem.created_at) == today
+    ).group_by(QueueItem.service_id).all())
+    waiting = dict(db.session.query(QueueItem.service_id, db.func.count(QueueItem.id)).filter(
+        QueueItem.service_id.in_(services.keys()),
+        QueueItem.status == 'waiting'
+    ).group_by(QueueItem.service_id).all())
+    
+    # Create in issue order so buffered tickets are numbered the way they were handed out
+    results = {}
+    created = []
+    new_items = []
+    for ticket in sorted(tickets, key=lambda t: t.get('issued_at') or 0):
+        key = ticket['idempotency_key']
+        service = services.get(ticket.get('service_id'))
+        phone = ticket.get('phone_number')
+        
+        if key in existing:
+            item = existing[key]
+            results[key] = {'idempotency_key': key, 'success': True, 'duplicate': True,
+                            **_ticket_info(item, services.get(item.service_id) or Service.query.get(item.service_id))}
+            continue
+        if not service or not phone:
+            results[key] = {'idempotency_key': key, 'success': False,
+                            'error': 'Service not found' if phone else 'Service and phone number required'}
+            continue
+        
+        counts[service.id] = counts.get(service.id, 0) + 1
+        position = waiting.get(service.id, 0) + 1
+        waiting[service.id] = position
+        
+        item = QueueItem(
+            queue_number=f"{service.name[:3].upper()}{counts[service.id]:03d}",
+            service_id=service.id,
+            phone_number=phone,
+            status='waiting',
+            created_at=_issued_at(ticket.get('issued_at')) or datetime.utcnow(),
+            idempotency_key=key
+        )
+        db.session.add(item)
+        existing[key] = item
+        new_items.append((item, service))
+        
+        info = {
+            'queue_number': item.queue_number,
+            'counter': service.counter_number,
+            'estimated_wait': (position - 1) * service.avg_service_time,
+            'position': position
+        }
+        results[key] = {'idempotency_key': key, 'success': True, **info}
+        created.append((phone, service, info))
+    
+    try:
+        for item, service in new_items:
+            record_transition(item, service.organization_id, None, at=item.created_at)
+        db.session.commit()
+    except IntegrityError:
+        # Another sync of the same tickets committed first; the kiosk retries and gets duplicates
+        db.session.rollback()
+        return jsonify({'error': 'Batch conflicted with a concurrent sync, retry'}), 409
+    
+    for phone, service, info in created:
+        _send_ticket_sms(phone, service, info)
+    
+    return jsonify({'success': True, 'results': [results[key] for key in keys]})
 
 @bp.route('/display')
 def display():
@@ -85,40 +257,64 @@ def display():
     return render_template('client_display.html')
 
 @bp.route('/api/display-status', methods=['GET'])
+@read_only
 def display_status():
     """Get current serving status for all services in an organization"""
     org_id = request.args.get('org_id', type=int)
     if not org_id:
         return jsonify({'error': 'Organization ID required'}), 400
+    # Only real organizations get a cached snapshot
+    if not get_organization(org_id):
+        return jsonify({'error': 'Organization not found'}), 404
     
-    services = Service.query.filter_by(organization_id=org_id, is_active=True).all()
+    snapshot = get_snapshot(org_id)
+    return jsonify([{
+        'service_name': name,
+        'counter': counter,
+        'now_serving': now_serving,
+        'next': next_number,
+        'waiting': waiting
+    } for _, name, counter, now_serving, next_number, waiting in snapshot.rows])
+
+def _id_list(name):
+    """Parse a comma-separated list of ids from the query string"""
+    value = request.args.get(name, '')
+    return [int(v) for v in value.split(',') if v.strip().isdigit()]
+
+@bp.route('/api/display-feed', methods=['GET'])
+@read_only
+def display_feed():
+    """Serving status for several organizations in one compact payload.
+
+    ?org_ids=1,2 selects organizations and ?service_ids=3,4 optionally narrows
+    the services shown. Screens send If-None-Match and get 304 until something changes.
+    """
+    org_ids = _id_list('org_ids')
+    service_ids = set(_id_list('service_ids'))
+    if not org_ids:
+        return jsonify({'error': 'Organization IDs required'}), 400
+    if len(org_ids) > MAX_FEED_ORGS:
+        return jsonify({'error': f'At most {MAX_FEED_ORGS} organizations per feed'}), 400
     
-    result = []
-    for service in services:
-        # Get currently serving
-        serving = QueueItem.query.filter_by(
-            service_id=service.id,
-            status='serving'
-        ).order_by(QueueItem.called_at.desc()).first()
-        
-        # Get next in queue
-        next_item = QueueItem.query.filter_by(
-            service_id=service.id,
-            status='waiting'
-        ).order_by(QueueItem.created_at).first()
-        
-        # Get waiting count
-        waiting_count = QueueItem.query.filter_by(
-            service_id=service.id,
-            status='waiting'
-        ).count()
-        
-        result.append({
-            'service_name': service.name,
-            'counter': service.counter_number,
-            'now_serving': serving.queue_number if serving else None,
-            'next': next_item.queue_number if next_item else None,
-            'waiting': waiting_count
-        })
+    # Unknown ids are dropped rather than given a cached snapshot each
+    orgs = [(org_id, get_organization(org_id)) for org_id in dict.fromkeys(org_ids)]
+    orgs = [(org_id, org) for org_id, org in orgs if org]
+    if not orgs:
+        return jsonify({'error': 'Organization not found'}), 404
     
-    return jsonify(result)
\ No newline at end of file
+    snapshots = [(org_id, org, get_snapshot(org_id)) for org_id, org in orgs]
+    etag = hashlib.md5(
+        (','.join(f'{org_id}:{snap.etag}' for org_id, _, snap in snapshots)
+         + request.args.get('service_ids', '')).encode()
+    ).hexdigest()[:16]
+    if etag in request.if_none_match:
+        response = make_response('', 304)
+    else:
+        orgs = []
+        for org_id, org, snap in snapshots:
+            rows = [row for row in snap.rows if row[0] in service_ids] if service_ids else snap.rows
+            orgs.append({'id': org_id, 'name': org.get('name'), 'seq': snap.seq, 'rows': rows})
+        response = jsonify({'fields': DISPLAY_FIELDS, 'orgs': orgs})
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
@@ -1,17 +1,15 @@
-from flask import Blueprint, render_template, request, jsonify, session, redirect, url_for
-from app.models import db, User, QueueItem, Service
+from flask import Blueprint, render_template, request, jsonify, session, redirect, url_for, after_this_request
+from app.models import db, User, QueueItem, ServiceDailyStats, StaffHourlyStats, QUEUE_ITEM_COLUMNS
+from app.events import (record_transition, catch_up, DailyStatsProjection, StaffStatsProjection,
+                        NotificationProjection)
+from app.serialization import select_rows, rows_response
 from datetime import datetime, date
-from functools import wraps
+from app.auth import role_required, current_service, current_principal
+from app.idempotency import idempotent
 
 bp = Blueprint('staff', __name__, url_prefix='/staff')
 
-def staff_required(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if 'user_id' not in session or session.get('role') != 'staff':
-            return redirect(url_for('staff.login'))
-        return f(*args, **kwargs)
-    return decorated_function
+staff_required = role_required('staff', 'staff.login')
 
 @bp.route('/login', methods=['GET', 'POST'])
 def login():
@@ -52,102 +50,186 @@ def get_queue():
     
     # Get all queue items for today
     today = date.today()
-    queue_items = QueueItem.query.filter_by(service_id=service_id).filter(
-        db.func.date(QueueItem.created_at) == today
-    ).order_by(QueueItem.created_at).all()
+    rows = select_rows(QUEUE_ITEM_COLUMNS,
+                       QueueItem.service_id == service_id,
+                       db.func.date(QueueItem.created_at) == today,
+                       order_by=QueueItem.created_at)
     
-    return jsonify([item.to_dict() for item in queue_items])
+    return rows_response(QUEUE_ITEM_COLUMNS, rows)
 
 @bp.route('/api/service-info', methods=['GET'])
 @staff_required
 def service_info():
     """Get service information"""
-    service_id = session.get('service_id')
-    if not service_id:
+    service = current_service()
+    if not service:
         return jsonify({'error': 'No service assigned'}), 400
     
-    service = Service.query.get(service_id)
-    return jsonify(service.to_dict())
+    return jsonify(service)
 
-@bp.route('/api/call-next', methods=['POST'])
-@staff_required
-def call_next():
-    """Call next person in queue"""
-    service_id = session.get('service_id')
+MAX_BATCH_ACTIONS = 10
+MAX_CALL_ATTEMPTS = 10
+
+def _notify_called(org_id):
+    """Text called clients once the request's transaction is committed"""
+    @after_this_request
+    def notify(response):
+        catch_up(NotificationProjection(), org_id)
+        return response
+
+def _move(item, from_status, **values):
+    """Update a ticket only if it is still in `from_status`, returning whether this request did.
+
+    Reads aren't locked, so two desks can pick the same ticket; the status
+    guard lets exactly one of them have it (as in the sweeper).
+    """
+    moved = db.session.execute(
+        db.update(QueueItem)
+        .where(QueueItem.id == item.id, QueueItem.status == from_status)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    ).rowcount == 1
+    db.session.refresh(item)
+    return moved
+
+def _call_next(principal, service_id, now):
+    """Close this staff member's current ticket and call the next one; the caller commits"""
+    org_id = principal.organization_id
     
-    # Mark any currently serving as done
-    current = QueueItem.query.filter_by(service_id=service_id, status='serving').first()
-    if current:
-        current.status = 'done'
-        current.completed_at = datetime.utcnow()
+    # Mark the ticket this staff member is serving as done; other desks on the service keep theirs
+    current = QueueItem.query.filter(
+        QueueItem.service_id == service_id,
+        QueueItem.status == 'serving',
+        db.or_(QueueItem.served_by == principal.id, QueueItem.served_by.is_(None))
+    ).first()
+    if current and _move(current, 'serving', status='done', completed_at=now,
+                         served_by=db.func.coalesce(QueueItem.served_by, principal.id)):
+        record_transition(current, org_id, 'serving', since=current.called_at, at=now)
     
-    # Get next waiting
-    next_item = QueueItem.query.filter_by(
-        service_id=service_id,
-        status='waiting'
-    ).order_by(QueueItem.created_at).first()
+    # Claim the oldest waiting ticket; if another desk got it first, try the next one
+    taken = []
+    for _ in range(MAX_CALL_ATTEMPTS):
+        next_item = QueueItem.query.filter(
+            QueueItem.service_id == service_id,
+            QueueItem.status == 'waiting',
+            QueueItem.id.notin_(taken)
+        ).order_by(QueueItem.created_at).first()
+        if not next_item:
+            return {'success': False, 'message': 'No one waiting'}, 200
+        if _move(next_item, 'waiting', status='serving', called_at=now, served_by=principal.id):
+            record_transition(next_item, org_id, 'waiting', since=next_item.created_at, at=now)
+            _notify_called(org_id)
+            return {'success': True, 'queue_item': next_item.to_dict()}, 200
+        taken.append(next_item.id)
     
-    if next_item:
-        next_item.status = 'serving'
-        next_item.called_at = datetime.utcnow()
-        db.session.commit()
-        return jsonify({'success': True, 'queue_item': next_item.to_dict()})
+    # People are still waiting but other desks kept taking them; a 5xx rolls back and
+    # isn't stored against the idempotency key, so the staff client retries with the same key
+    return {'success': False, 'error': 'Other desks are calling at the same time, retry'}, 503
+
+def _close(principal, service_id, item_id, status, now):
+    """Mark a waiting or serving ticket done or skipped; the caller commits"""
+    item = db.session.get(QueueItem, item_id) if isinstance(item_id, int) else None
+    if not item or item.service_id != service_id:
+        return {'error': 'Item not found'}, 404
+    
+    # A second click, or another desk, must not count the ticket twice
+    previous = item.status
+    values = {'status': status}
+    if status == 'done':
+        values.update(completed_at=now, served_by=db.func.coalesce(QueueItem.served_by, principal.id))
+    if previous not in ('waiting', 'serving') or not _move(item, previous, **values):
+        return {'error': f'Ticket is already {item.status}'}, 409
     
-    db.session.commit()
-    return jsonify({'success': False, 'message': 'No one waiting'})
+    record_transition(item, principal.organization_id, previous,
+                      since=item.called_at if previous == 'serving' else item.created_at, at=now)
+    return {'success': True}, 200
+
+@bp.route('/api/call-next', methods=['POST'])
+@staff_required
+@idempotent
+def call_next():
+    """Call next person in queue"""
+    payload, status = _call_next(current_principal(), session.get('service_id'), datetime.utcnow())
+    return jsonify(payload), status
 
 @bp.route('/api/mark-done/<int:item_id>', methods=['POST'])
 @staff_required
+@idempotent
 def mark_done(item_id):
     """Mark current client as done"""
-    item = QueueItem.query.get(item_id)
-    if item and item.service_id == session.get('service_id'):
-        item.status = 'done'
-        item.completed_at = datetime.utcnow()
-        db.session.commit()
-        return jsonify({'success': True})
-    return jsonify({'error': 'Item not found'}), 404
+    payload, status = _close(current_principal(), session.get('service_id'), item_id, 'done', datetime.utcnow())
+    return jsonify(payload), status
 
 @bp.route('/api/skip/<int:item_id>', methods=['POST'])
 @staff_required
+@idempotent
 def skip(item_id):
     """Skip a client"""
-    item = QueueItem.query.get(item_id)
-    if item and item.service_id == session.get('service_id'):
-        item.status = 'skipped'
-        db.session.commit()
-        return jsonify({'success': True})
-    return jsonify({'error': 'Item not found'}), 404
+    payload, status = _close(current_principal(), session.get('service_id'), item_id, 'skipped', datetime.utcnow())
+    return jsonify(payload), status
+
+@bp.route('/api/actions', methods=['POST'])
+@staff_required
+@idempotent
+def batch_actions():
+    """Apply several actions in one transaction, e.g. mark done + call next.
+
+    Body: {"idempotency_key": "...", "actions": [{"type": "done", "item_id": 5}, {"type": "call_next"}]}
+    Types are call_next, done and skip. If one action fails, none are applied.
+    """
+    actions = (request.get_json(silent=True) or {}).get('actions')
+    if not isinstance(actions, list) or not actions:
+        return jsonify({'error': 'actions required'}), 400
+    if len(actions) > MAX_BATCH_ACTIONS:
+        return jsonify({'error': f'At most {MAX_BATCH_ACTIONS} actions per batch'}), 400
+    
+    principal = current_principal()
+    service_id = session.get('service_id')
+    now = datetime.utcnow()
+    results = []
+    for index, action in enumerate(actions):
+        kind = action.get('type') if isinstance(action, dict) else None
+        if kind == 'call_next':
+            payload, status = _call_next(principal, service_id, now)
+        elif kind in ('done', 'skip'):
+            payload, status = _close(principal, service_id, action.get('item_id'),
+                                     'done' if kind == 'done' else 'skipped', now)
+        else:
+            payload, status = {'error': 'Unknown action type'}, 400
+        if status >= 400:
+            return jsonify({**payload, 'index': index}), status
+        results.append(payload)
+    
+    return jsonify({'success': True, 'results': results})
 
 @bp.route('/api/stats', methods=['GET'])
 @staff_required
 def stats():
     """Get daily stats"""
     service_id = session.get('service_id')
-    today = date.today()
-    
-    # Total served today
-    served = QueueItem.query.filter_by(service_id=service_id, status='done').filter(
-        db.func.date(QueueItem.created_at) == today
-    ).count()
     
-    # Calculate average wait time
-    completed = QueueItem.query.filter_by(service_id=service_id, status='done').filter(
-        db.func.date(QueueItem.created_at) == today,
-        QueueItem.called_at.isnot(None)
-    ).all()
+    # Served count and average wait come from the event-fed daily rollups
+    principal = current_principal()
+    today = datetime.utcnow().date()
+    catch_up(DailyStatsProjection(), principal.organization_id)
+    catch_up(StaffStatsProjection(), principal.organization_id)
+    rollup = db.session.get(ServiceDailyStats, (service_id, today))
+    served_by_me = db.session.query(db.func.sum(StaffHourlyStats.served)).filter(
+        StaffHourlyStats.user_id == principal.id,
+        StaffHourlyStats.hour >= datetime.combine(today, datetime.min.time())
+    ).scalar() or 0
     
+    served = rollup.served if rollup else 0
     avg_wait = 0
-    if completed:
-        total_wait = sum([(item.called_at - item.created_at).total_seconds() / 60 
-                          for item in completed])
-        avg_wait = round(total_wait / len(completed), 1)
+    if rollup and rollup.called:
+        avg_wait = round(rollup.wait_seconds / 60 / rollup.called, 1)
     
     # Currently waiting
     waiting = QueueItem.query.filter_by(service_id=service_id, status='waiting').count()
     
     return jsonify({
         'served_today': served,
+        'served_by_me_today': served_by_me,
         'avg_wait_time': avg_wait,
         'currently_waiting': waiting
     })
\ No newline at end of file
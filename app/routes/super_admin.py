@@ -1,16 +1,21 @@
 from flask import Blueprint, render_template, request, jsonify, session, redirect, url_for
-from app.models import db, User, Organization, Service
-from functools import wraps
+from app.models import (db, User, Organization, Service, QueueItem, QueueEvent, EventSequence,
+                        ProjectionCheckpoint, ServiceDailyStats, StaffHourlyStats, StaffServiceTimes,
+                        StaffActivity, StaffAction, SweepRun)
+from app.replicas import read_only
+from app.sharding import set_tenant, fan_out
+from app.display import invalidate as invalidate_display
+from datetime import date
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from app.auth import role_required, invalidate_user, invalidate_organization
 
 bp = Blueprint('super_admin', __name__, url_prefix='/super-admin')
 
-def super_admin_required(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if 'user_id' not in session or session.get('role') != 'super_admin':
-            return redirect(url_for('super_admin.login'))
-        return f(*args, **kwargs)
-    return decorated_function
+super_admin_required = role_required('super_admin', 'super_admin.login')
+
+# Per-organization rows the ORM cascade doesn't reach: the event log and its projections
+ORGANIZATION_DATA = (QueueEvent, EventSequence, ProjectionCheckpoint, ServiceDailyStats, StaffHourlyStats,
+                     StaffActivity, StaffAction, SweepRun)
 
 @bp.route('/login', methods=['GET', 'POST'])
 def login():
@@ -40,9 +45,19 @@ def logout():
 def dashboard():
     return render_template('super_admin_dashboard.html')
 
+def _valid_timezone(name):
+    if not name:
+        return True
+    try:
+        ZoneInfo(name)
+        return True
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+
 # Organization Management
 @bp.route('/api/organizations', methods=['GET'])
 @super_admin_required
+@read_only
 def get_organizations():
     """Get all organizations with stats"""
     orgs = Organization.query.all()
@@ -68,10 +83,14 @@ def create_organization():
     """Create new organization"""
     data = request.json
     
+    if not _valid_timezone(data.get('timezone')):
+        return jsonify({'error': 'Unknown timezone'}), 400
+    
     org = Organization(
         name=data['name'],
         location=data.get('location', ''),
-        contact=data.get('contact', '')
+        contact=data.get('contact', ''),
+        timezone=data.get('timezone') or None
     )
     db.session.add(org)
     db.session.commit()
@@ -86,11 +105,16 @@ def update_organization(org_id):
         return jsonify({'error': 'Organization not found'}), 404
     
     data = request.json
+    if not _valid_timezone(data.get('timezone')):
+        return jsonify({'error': 'Unknown timezone'}), 400
+    
     org.name = data.get('name', org.name)
     org.location = data.get('location', org.location)
     org.contact = data.get('contact', org.contact)
+    org.timezone = data.get('timezone', org.timezone) or None
     
     db.session.commit()
+    invalidate_organization(org_id)
     return jsonify(org.to_dict())
 
 @bp.route('/api/organizations/<int:org_id>', methods=['DELETE'])
@@ -101,13 +125,23 @@ def delete_organization(org_id):
     if not org:
         return jsonify({'error': 'Organization not found'}), 404
     
+    # Deleting cascades to the org's queue items, which may live on a shard
+    set_tenant(org_id)
+    staff_ids = [user_id for user_id, in db.session.query(User.id).filter_by(organization_id=org_id)]
+    for model in ORGANIZATION_DATA:
+        model.query.filter_by(organization_id=org_id).delete(synchronize_session=False)
+    if staff_ids:
+        StaffServiceTimes.query.filter(StaffServiceTimes.user_id.in_(staff_ids)).delete(synchronize_session=False)
     db.session.delete(org)
     db.session.commit()
+    invalidate_organization(org_id)
+    invalidate_display(org_id)
     return jsonify({'success': True})
 
 # Admin Management
 @bp.route('/api/admins', methods=['GET'])
 @super_admin_required
+@read_only
 def get_admins():
     """Get all organization admins"""
     admins = User.query.filter_by(role='admin').all()
@@ -158,6 +192,7 @@ def update_admin(admin_id):
         admin.set_password(data['password'])
     
     db.session.commit()
+    invalidate_user(admin_id)
     return jsonify(admin.to_dict())
 
 @bp.route('/api/admins/<int:admin_id>', methods=['DELETE'])
@@ -170,11 +205,13 @@ def delete_admin(admin_id):
     
     db.session.delete(admin)
     db.session.commit()
+    invalidate_user(admin_id)
     return jsonify({'success': True})
 
 # Overview Stats
 @bp.route('/api/overview', methods=['GET'])
 @super_admin_required
+@read_only
 def overview():
     """Get system overview statistics"""
     total_orgs = Organization.query.count()
@@ -182,9 +219,24 @@ def overview():
     total_staff = User.query.filter_by(role='staff').count()
     total_services = Service.query.count()
     
+    # Queue data is spread over the tenant shards
+    queue_counts = fan_out(_queue_counts)
+    
     return jsonify({
         'total_organizations': total_orgs,
         'total_admins': total_admins,
         'total_staff': total_staff,
-        'total_services': total_services
-    })
\ No newline at end of file
+        'total_services': total_services,
+        'currently_waiting': sum(c['waiting'] for c in queue_counts),
+        'served_today': sum(c['served_today'] for c in queue_counts)
+    })
+
+def _queue_counts():
+    """Count waiting and served tickets on the current shard"""
+    today = date.today()
+    return {
+        'waiting': QueueItem.query.filter_by(status='waiting').count(),
+        'served_today': QueueItem.query.filter_by(status='done').filter(
+            db.func.date(QueueItem.created_at) == today
+        ).count()
+    }
\ No newline at end of file
@@ -0,0 +1,35 @@
+"""Bring an existing database up to the current models.
+
+``create_all`` creates missing tables but never touches existing ones, so
+columns added to a model since the database was created are added here with
+``ALTER TABLE``. New columns must be nullable; unique and indexed ones get
+their index created along with them.
+"""
+import sqlalchemy as sa
+
+
+def add_missing_columns(engine, tables):
+    """Add the columns of `tables` that the database lacks, returning their 'table.column' names"""
+    inspector = sa.inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+    added = []
+    with engine.begin() as conn:
+        for table in tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                conn.exec_driver_sql(
+                    f'ALTER TABLE {preparer.format_table(table)} ADD COLUMN '
+                    f'{preparer.format_column(column)} {column.type.compile(dialect=engine.dialect)}'
+                )
+                if column.unique or column.index:
+                    conn.exec_driver_sql(
+                        f'CREATE {"UNIQUE " if column.unique else ""}INDEX '
+                        f'{preparer.quote(f"ix_{table.name}_{column.name}")} '
+                        f'ON {preparer.format_table(table)} ({preparer.format_column(column)})'
+                    )
+                added.append(f'{table.name}.{column.name}')
+    return added
@@ -0,0 +1,72 @@
+"""Fast JSON output for list endpoints.
+
+List endpoints select plain row tuples (see the ``*_COLUMNS`` tuples in
+``app.models``) instead of loading ORM objects and calling ``to_dict`` per row.
+Responses are encoded with orjson when it is installed and fall back to the
+standard library otherwise.
+"""
+from datetime import date, datetime, timedelta
+
+import sqlalchemy as sa
+from flask import jsonify, request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional speed-up
+    orjson = None
+
+EPOCH = datetime(1970, 1, 1)
+MILLISECOND = timedelta(milliseconds=1)
+
+
+def _default(o):
+    # Match to_dict(): ISO 8601 instead of Flask's HTTP date format
+    if isinstance(o, (datetime, date)):
+        return o.isoformat()
+    return DefaultJSONProvider.default(o)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """JSON provider that uses orjson for responses when available"""
+
+    default = staticmethod(_default)
+
+    def response(self, *args, **kwargs):
+        if orjson is None or self._app.debug:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def select_rows(columns, *criteria, order_by=None, limit=None):
+    """Fetch the given columns as row tuples, skipping the ORM identity map"""
+    from app.models import db
+
+    query = sa.select(*columns).where(*criteria)
+    if order_by is not None:
+        query = query.order_by(order_by)
+    if limit is not None:
+        query = query.limit(limit)
+    return db.session.execute(query).all()
+
+
+def compact(columns, rows):
+    """Compact wire format: a field header, then one array per row with epoch-ms timestamps"""
+    time_fields = [i for i, c in enumerate(columns) if isinstance(c.type, sa.DateTime)]
+    packed = [list(row) for row in rows]
+    for i in time_fields:
+        for row in packed:
+            value = row[i]
+            if value is not None:
+                row[i] = (value - EPOCH) // MILLISECOND
+    return {'fields': [c.key for c in columns], 'rows': packed}
+
+
+def rows_response(columns, rows):
+    """Respond with rows as a list of dicts, or in the compact format for ?format=compact"""
+    if request.args.get('format') == 'compact':
+        return jsonify(compact(columns, rows))
+    names = [c.key for c in columns]
+    return jsonify([dict(zip(names, row)) for row in rows])
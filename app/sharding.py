@@ -0,0 +1,89 @@
+"""Tenant-aware routing of queue data.
+
+Organizations listed in ``TENANT_SHARDS`` keep their queue data on one of the
+``SQLALCHEMY_BINDS`` databases; everyone else stays on the default database.
+Reference data (organizations, users, services) always lives on the default
+database, so only the tables in ``SHARDED_TABLES`` are routed.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import sqlalchemy as sa
+from flask import current_app, g, has_app_context
+
+from app.schema import add_missing_columns
+
+SHARDED_TABLES = {'queue_items', 'queue_events', 'event_sequences', 'projection_checkpoints',
+                  'service_daily_stats', 'staff_hourly_stats', 'staff_service_times', 'staff_activity',
+                  'staff_actions'}
+
+
+def is_sharded(mapper, clause):
+    """Check whether a query targets one of the sharded tables"""
+    table = None
+    if mapper is not None:
+        table = sa.inspect(mapper).local_table
+    elif isinstance(clause, sa.Table):
+        table = clause
+    elif isinstance(clause, sa.UpdateBase):
+        table = clause.table
+    return getattr(table, 'name', None) in SHARDED_TABLES
+
+
+def shard_for_org(org_id):
+    """Get the bind key holding an organization's queue data (None = default)"""
+    return current_app.config.get('TENANT_SHARDS', {}).get(org_id)
+
+
+def shard_keys():
+    """All bind keys that may hold queue data, default database first"""
+    return [None] + sorted(set(current_app.config.get('TENANT_SHARDS', {}).values()))
+
+
+def set_tenant(org_id):
+    """Route queue queries for the rest of this request to the org's shard"""
+    g.shard_key = shard_for_org(org_id)
+
+
+def current_shard():
+    if not has_app_context():
+        return None
+    return g.get('shard_key')
+
+
+def _run_on_shard(app, key, fn):
+    with app.app_context():
+        g.shard_key = key
+        return fn()
+
+
+def fan_out(fn):
+    """Call `fn` once per shard in parallel and return the results in shard order.
+
+    Each call runs in its own app context, and so its own DB session.
+    """
+    app = current_app._get_current_object()
+    keys = shard_keys()
+    if len(keys) == 1:
+        return [fn()]
+    with ThreadPoolExecutor(max_workers=len(keys)) as pool:
+        futures = [pool.submit(_run_on_shard, app, key, fn) for key in keys]
+        return [f.result() for f in futures]
+
+
+def create_shard_tables(db):
+    """Create the sharded tables on every tenant database.
+
+    Foreign keys can't span databases, so shard copies are created without them.
+    """
+    metadata = sa.MetaData()
+    tables = []
+    for name in SHARDED_TABLES:
+        table = db.metadata.tables[name].to_metadata(metadata)
+        for constraint in table.foreign_key_constraints:
+            table.constraints.discard(constraint)
+        tables.append(table)
+    for key in shard_keys()[1:]:
+        for table in tables:
+            table.create(db.engines[key], checkfirst=True)
+        for column in add_missing_columns(db.engines[key], tables):
+            print(f"Added {column} on {key}")
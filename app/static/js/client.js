@@ -2,13 +2,95 @@ let selectedOrg = null;
 let selectedService = null;
 let services = [];
 
+// Tickets issued while offline wait here until they are synced
+const PENDING_KEY = 'smartq_pending_tickets';
+const SYNC_BATCH_SIZE = 50;
+const SYNC_INTERVAL = 15000;
+let syncing = false;
+
 // Load organizations on page load
-document.addEventListener('DOMContentLoaded', loadOrganizations);
+document.addEventListener('DOMContentLoaded', () => {
+    loadOrganizations();
+    syncPendingTickets();
+    setInterval(syncPendingTickets, SYNC_INTERVAL);
+    window.addEventListener('online', syncPendingTickets);
+});
+
+// Fetch JSON, falling back to the last copy saved for offline use
+async function fetchCached(url) {
+    try {
+        const response = await fetch(url);
+        const data = await response.json();
+        localStorage.setItem(`smartq_cache:${url}`, JSON.stringify(data));
+        return data;
+    } catch (error) {
+        const cached = localStorage.getItem(`smartq_cache:${url}`);
+        if (cached) return JSON.parse(cached);
+        throw error;
+    }
+}
+
+function newIdempotencyKey() {
+    if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+    return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 12)}`;
+}
+
+function loadPendingTickets() {
+    return JSON.parse(localStorage.getItem(PENDING_KEY) || '[]');
+}
+
+function savePendingTickets(tickets) {
+    localStorage.setItem(PENDING_KEY, JSON.stringify(tickets));
+}
+
+async function syncPendingTickets() {
+    if (syncing) return;
+    syncing = true;
+    try {
+        let pending = loadPendingTickets();
+        while (pending.length) {
+            // The server takes one organization per batch
+            const orgId = pending[0].org_id;
+            const batch = pending.filter(t => t.org_id === orgId).slice(0, SYNC_BATCH_SIZE);
+            
+            const response = await fetch('/client/api/join-queue/batch', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ tickets: batch })
+            });
+            if (!response.ok) break;
+            // A captive portal can answer 200 with a login page; that throws here and is retried
+            const data = await response.json();
+            
+            // Only tickets the server answered for (created, duplicate or rejected) are done
+            const done = new Set((data.results || []).map(r => r.idempotency_key));
+            if (!done.size) break;
+            pending = loadPendingTickets().filter(t => !done.has(t.idempotency_key));
+            savePendingTickets(pending);
+        }
+    } catch (error) {
+        console.error('Error syncing tickets, will retry:', error);
+    } finally {
+        syncing = false;
+    }
+}
+
+function showTicket(ticket, provisional) {
+    document.getElementById('queueNumber').textContent = ticket.queue_number;
+    document.getElementById('counter').textContent = ticket.counter;
+    document.getElementById('position').textContent = provisional ? '-' : ticket.position;
+    document.getElementById('waitTime').textContent = provisional ? '-' : ticket.estimated_wait;
+    document.getElementById('smsNotice').textContent = provisional
+        ? '📱 Offline ticket saved. Your final number will be sent by SMS'
+        : '📱 SMS confirmation sent to your phone';
+    
+    document.getElementById('phone-input').style.display = 'none';
+    document.getElementById('ticket-display').style.display = 'block';
+}
 
 async function loadOrganizations() {
     try {
-        const response = await fetch('/client/api/organizations');
-        const orgs = await response.json();
+        const orgs = await fetchCached('/client/api/organizations');
         
         const select = document.getElementById('organizationSelect');
         orgs.forEach(org => {
@@ -31,8 +113,7 @@ async function loadOrganizations() {
 
 async function loadServices() {
     try {
-        const response = await fetch(`/client/api/services?org_id=${selectedOrg}`);
-        services = await response.json();
+        services = await fetchCached(`/client/api/services?org_id=${selectedOrg}`);
         
         const container = document.getElementById('serviceButtons');
         container.innerHTML = services.map(service => 
@@ -75,32 +156,41 @@ async function joinQueue() {
         return;
     }
     
+    const ticket = {
+        idempotency_key: newIdempotencyKey(),
+        org_id: selectedOrg,
+        service_id: selectedService,
+        phone_number: phone,
+        issued_at: Date.now()
+    };
+    
+    let response;
     try {
-        const response = await fetch('/client/api/join-queue', {
+        response = await fetch('/client/api/join-queue', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
-                service_id: selectedService,
-                phone_number: phone
-            })
+            body: JSON.stringify(ticket)
         });
-        
-        const data = await response.json();
-        
-        if (data.success) {
-            document.getElementById('queueNumber').textContent = data.queue_number;
-            document.getElementById('counter').textContent = data.counter;
-            document.getElementById('position').textContent = data.position;
-            document.getElementById('waitTime').textContent = data.estimated_wait;
-            
-            document.getElementById('phone-input').style.display = 'none';
-            document.getElementById('ticket-display').style.display = 'block';
-        } else {
-            alert(data.error || 'Failed to join queue');
-        }
     } catch (error) {
-        console.error('Error joining queue:', error);
-        alert('Failed to join queue');
+        response = null;
+    }
+    
+    if (!response || response.status >= 500) {
+        // Network down: keep the ticket and hand out a provisional number
+        savePendingTickets([...loadPendingTickets(), ticket]);
+        const service = services.find(s => s.id === selectedService) || {};
+        showTicket({
+            queue_number: `P-${ticket.idempotency_key.slice(-4).toUpperCase()}`,
+            counter: service.counter_number
+        }, true);
+        return;
+    }
+    
+    const data = await response.json();
+    if (data.success) {
+        showTicket(data, false);
+    } else {
+        alert(data.error || 'Failed to join queue');
     }
 }
 
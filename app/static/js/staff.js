@@ -17,10 +17,15 @@ async function loadServiceInfo() {
     }
 }
 
+// Turn a compact {fields, rows} payload back into objects
+function expandRows(payload) {
+    return payload.rows.map(row => Object.fromEntries(payload.fields.map((field, i) => [field, row[i]])));
+}
+
 async function loadQueue() {
     try {
-        const response = await fetch('/staff/api/queue');
-        const queue = await response.json();
+        const response = await fetch('/staff/api/queue?format=compact');
+        const queue = expandRows(await response.json());
         
         const tbody = document.getElementById('queueBody');
         tbody.innerHTML = queue.map(item => `
@@ -32,6 +37,7 @@ async function loadQueue() {
                 <td>
                     ${item.status === 'serving' ? `
                         <button onclick="markDone(${item.id})" class="btn btn-primary">Done</button>
+                        <button onclick="markDoneAndNext(${item.id})" class="btn btn-primary">Done &amp; Next</button>
                     ` : ''}
                     ${item.status === 'waiting' ? `
                         <button onclick="skip(${item.id})" class="btn btn-danger">Skip</button>
@@ -65,54 +71,97 @@ async function loadStats() {
     }
 }
 
-async function callNext() {
-    try {
-        const response = await fetch('/staff/api/call-next', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' }
-        });
-        
-        const data = await response.json();
-        
-        if (data.success) {
-            loadQueue();
-            loadStats();
-        } else {
-            alert(data.message || 'No one waiting');
+// Each click gets one idempotency key, reused when the request is retried,
+// so a flaky connection can never apply the same click twice
+const MAX_RETRIES = 3;
+let actionInFlight = false;
+
+function newIdempotencyKey() {
+    if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+    return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 12)}`;
+}
+
+async function postAction(url, body = {}) {
+    const payload = JSON.stringify({ ...body, idempotency_key: newIdempotencyKey() });
+    for (let attempt = 0; ; attempt++) {
+        try {
+            const response = await fetch(url, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: payload
+            });
+            if (response.status < 500 || attempt >= MAX_RETRIES) return response;
+        } catch (error) {
+            if (attempt >= MAX_RETRIES) throw error;
         }
-    } catch (error) {
-        console.error('Error calling next:', error);
+        await new Promise(resolve => setTimeout(resolve, 500 * 2 ** attempt));
     }
 }
 
-async function markDone(itemId) {
+// Ignore further clicks until the current action has finished
+async function runAction(fn) {
+    if (actionInFlight) return;
+    actionInFlight = true;
     try {
-        const response = await fetch(`/staff/api/mark-done/${itemId}`, {
-            method: 'POST'
-        });
-        
-        if (response.ok) {
-            loadQueue();
-            loadStats();
-        }
-    } catch (error) {
-        console.error('Error marking done:', error);
+        await fn();
+    } finally {
+        actionInFlight = false;
+        loadQueue();
+        loadStats();
     }
 }
 
-async function skip(itemId) {
+function callNext() {
+    return runAction(async () => {
+        try {
+            const response = await postAction('/staff/api/call-next');
+            const data = await response.json();
+            if (!data.success) {
+                alert(data.message || data.error || 'No one waiting');
+            }
+        } catch (error) {
+            console.error('Error calling next:', error);
+        }
+    });
+}
+
+function markDone(itemId) {
+    return runAction(async () => {
+        try {
+            await postAction(`/staff/api/mark-done/${itemId}`);
+        } catch (error) {
+            console.error('Error marking done:', error);
+        }
+    });
+}
+
+// Mark done and call the next client in a single request
+function markDoneAndNext(itemId) {
+    return runAction(async () => {
+        try {
+            const response = await postAction('/staff/api/actions', {
+                actions: [{ type: 'done', item_id: itemId }, { type: 'call_next' }]
+            });
+            const data = await response.json();
+            if (!data.success) {
+                alert(data.error || 'Could not complete the action');
+            } else if (!data.results[1].success) {
+                alert(data.results[1].message || 'No one waiting');
+            }
+        } catch (error) {
+            console.error('Error marking done:', error);
+        }
+    });
+}
+
+function skip(itemId) {
     if (!confirm('Skip this client?')) return;
     
-    try {
-        const response = await fetch(`/staff/api/skip/${itemId}`, {
-            method: 'POST'
-        });
-        
-        if (response.ok) {
-            loadQueue();
-            loadStats();
+    return runAction(async () => {
+        try {
+            await postAction(`/staff/api/skip/${itemId}`);
+        } catch (error) {
+            console.error('Error skipping:', error);
         }
-    } catch (error) {
-        console.error('Error skipping:', error);
-    }
+    });
 }
\ No newline at end of file
@@ -0,0 +1,126 @@
+"""Clean-up of tickets nobody closed.
+
+Run ``flask --app run.py sweep-queues`` from cron (e.g. every 15 minutes).
+For each organization it:
+
+- expires ``waiting`` and ``serving`` tickets created before local midnight
+  in the organization's timezone, and
+- if ``NO_SHOW_TIMEOUT`` is set, marks tickets called more than that many
+  minutes ago and still ``serving`` as ``skipped`` (the client never showed
+  up). It is off by default: nothing tells a no-show from a long
+  consultation, and a timed-out ticket can no longer be marked done.
+
+Tickets are updated in batches, each with its transition events, and every
+run is recorded in ``sweep_runs``. Staff idempotency keys older than
+``STAFF_ACTION_RETENTION`` hours are dropped as well.
+"""
+import time
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+import sqlalchemy as sa
+from flask import current_app
+
+from app.models import db, Organization, QueueItem, Service, StaffAction, SweepRun
+from app.events import record_bulk
+from app.sharding import set_tenant
+
+
+def local_zone(tz_name):
+    """Get an organization's timezone, falling back to DEFAULT_TIMEZONE"""
+    try:
+        return ZoneInfo(tz_name or current_app.config['DEFAULT_TIMEZONE'])
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo(current_app.config['DEFAULT_TIMEZONE'])
+
+
+def local_midnight_utc(tz_name, now):
+    """Start of the current local day in `tz_name`, as a naive UTC datetime"""
+    tz = local_zone(tz_name)
+    local_now = now.replace(tzinfo=timezone.utc).astimezone(tz)
+    midnight = local_now.replace(hour=0, minute=0, second=0, microsecond=0)
+    return midnight.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _sweep(org_id, criteria, to_status, now, batch_size):
+    """Move matching tickets to `to_status` in batches, returning how many moved"""
+    # Services live on the main database, so look their ids up rather than joining
+    service_ids = db.session.execute(sa.select(Service.id).where(Service.organization_id == org_id)).scalars().all()
+    if not service_ids:
+        return 0
+    moved = 0
+    while True:
+        rows = db.session.execute(
+            sa.select(QueueItem.id, QueueItem.service_id, QueueItem.status,
+                      QueueItem.created_at, QueueItem.called_at, QueueItem.served_by)
+            .where(QueueItem.service_id.in_(service_ids), *criteria)
+            .order_by(QueueItem.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return moved
+
+        ids = [row[0] for row in rows]
+        values = {'status': to_status}
+        if to_status == 'expired':
+            values['completed_at'] = now
+        # Status guard: a ticket changed by staff since the select is left alone
+        updated = db.session.execute(
+            sa.update(QueueItem)
+            .where(QueueItem.id.in_(ids), *criteria)
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if updated != len(ids):
+            db.session.rollback()
+            continue
+        record_bulk(org_id, [(item_id, service_id, status, to_status,
+                              called_at if status == 'serving' else created_at, served_by)
+                             for item_id, service_id, status, created_at, called_at, served_by in rows], at=now)
+        db.session.commit()
+        moved += updated
+
+
+def sweep_organization(org, now=None, batch_size=None):
+    """Sweep one organization's stale tickets and record the run"""
+    config = current_app.config
+    now = now or datetime.utcnow()
+    batch_size = batch_size or config['SWEEP_BATCH_SIZE']
+    started = time.perf_counter()
+    set_tenant(org.id)
+
+    cutoff = local_midnight_utc(org.timezone, now)
+    expired = _sweep(org.id, [QueueItem.status.in_(['waiting', 'serving']), QueueItem.created_at < cutoff],
+                     'expired', now, batch_size)
+
+    no_shows = 0
+    if config['NO_SHOW_TIMEOUT']:
+        called_before = now - timedelta(minutes=config['NO_SHOW_TIMEOUT'])
+        no_shows = _sweep(org.id, [QueueItem.status == 'serving', QueueItem.called_at < called_before],
+                          'skipped', now, batch_size)
+
+    StaffAction.query.filter(
+        StaffAction.organization_id == org.id,
+        StaffAction.created_at < now - timedelta(hours=config['STAFF_ACTION_RETENTION'])
+    ).delete(synchronize_session=False)
+
+    run = SweepRun(
+        organization_id=org.id,
+        ran_at=now,
+        expired=expired,
+        no_shows=no_shows,
+        duration_ms=int((time.perf_counter() - started) * 1000)
+    )
+    db.session.add(run)
+    db.session.commit()
+    return run
+
+
+def init_app(app):
+    @app.cli.command('sweep-queues')
+    def sweep_queues_command():
+        """Expire yesterday's open tickets and time out no-shows"""
+        for org in Organization.query.all():
+            run = sweep_organization(org)
+            if run.expired or run.no_shows:
+                print(f"org {org.id}: expired {run.expired}, no-shows {run.no_shows} ({run.duration_ms} ms)")
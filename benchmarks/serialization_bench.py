@@ -0,0 +1,107 @@
+"""Compare the ORM + to_dict() list path with row tuples and the compact format.
+
+All paths encode with the same encoder (orjson when installed), so the
+numbers show the cost of the query and projection. ``--stdlib`` reports the
+ORM path with Flask's stdlib encoder separately, for the encoder's share.
+
+Run from the project root:
+
+    python benchmarks/serialization_bench.py [rows] [repeats] [--stdlib]
+
+Uses an in-memory SQLite database, so it measures Python-side cost only.
+"""
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from flask import json
+from config import Config
+from app import create_app, init_db
+from app.models import db, Organization, Service, QueueItem, QUEUE_ITEM_COLUMNS
+from app.serialization import select_rows, compact, orjson
+
+
+class BenchConfig(Config):
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+
+
+def seed(rows):
+    org = Organization(name='Bench Hospital')
+    db.session.add(org)
+    db.session.flush()
+    service = Service(name='Consultation', organization_id=org.id)
+    db.session.add(service)
+    db.session.flush()
+    start = datetime.utcnow() - timedelta(hours=8)
+    db.session.add_all([
+        QueueItem(queue_number=f'CON{i:03d}', service_id=service.id, phone_number='0788000000',
+                  status='done' if i % 3 else 'waiting', created_at=start + timedelta(seconds=i),
+                  called_at=start + timedelta(seconds=i + 60), completed_at=start + timedelta(seconds=i + 300))
+        for i in range(rows)
+    ])
+    db.session.commit()
+    return service.id
+
+
+def orm_to_dict(service_id):
+    items = QueueItem.query.filter_by(service_id=service_id).order_by(QueueItem.created_at).all()
+    return _dumps([item.to_dict() for item in items])
+
+
+def orm_stdlib(service_id):
+    items = QueueItem.query.filter_by(service_id=service_id).order_by(QueueItem.created_at).all()
+    return json.dumps([item.to_dict() for item in items])
+
+
+def row_dicts(service_id):
+    rows = select_rows(QUEUE_ITEM_COLUMNS, QueueItem.service_id == service_id, order_by=QueueItem.created_at)
+    names = [c.key for c in QUEUE_ITEM_COLUMNS]
+    return _dumps([dict(zip(names, row)) for row in rows])
+
+
+def row_compact(service_id):
+    rows = select_rows(QUEUE_ITEM_COLUMNS, QueueItem.service_id == service_id, order_by=QueueItem.created_at)
+    return _dumps(compact(QUEUE_ITEM_COLUMNS, rows))
+
+
+def _dumps(obj):
+    return orjson.dumps(obj) if orjson is not None else json.dumps(obj)
+
+
+def bench(fn, service_id, repeats):
+    fn(service_id)
+    best = float('inf')
+    for _ in range(repeats):
+        db.session.expunge_all()
+        start = time.perf_counter()
+        body = fn(service_id)
+        best = min(best, time.perf_counter() - start)
+    return best, len(body)
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    rows = int(args[0]) if args else 2000
+    repeats = int(args[1]) if len(args) > 1 else 20
+    paths = [('orm + to_dict', orm_to_dict), ('row tuples', row_dicts), ('compact', row_compact)]
+    if '--stdlib' in sys.argv:
+        paths.insert(0, ('orm, stdlib json', orm_stdlib))
+    app = create_app(BenchConfig)
+    with app.app_context():
+        init_db()
+        service_id = seed(rows)
+        print(f'{rows} rows, best of {repeats}, encoder: {"orjson" if orjson else "json"}')
+        baseline = None
+        for name, fn in paths:
+            seconds, size = bench(fn, service_id, repeats)
+            baseline = baseline or seconds
+            print(f'{name:<16} {seconds * 1000:8.2f} ms  {size / 1024:7.1f} KiB  {baseline / seconds:5.2f}x')
+
+
+if __name__ == '__main__':
+    main()
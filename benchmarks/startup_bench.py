@@ -0,0 +1,64 @@
+"""Measure how long a fresh worker takes to become ready.
+
+Run from the project root:
+
+    python benchmarks/startup_bench.py [runs]
+
+Each run starts a new interpreter that imports ``run.app`` (what a WSGI
+server does) and then serves one kiosk API request. Reports the median of:
+
+- import: importing ``run`` and building the app
+- first request: import plus the first response
+- process: the whole subprocess, including interpreter start-up
+
+Uses a SQLite file that is initialised once before timing.
+"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r'''
+import time
+start = time.perf_counter()
+from run import app
+imported = time.perf_counter()
+response = app.test_client().get('/client/api/organizations')
+assert response.status_code == 200, response.status_code
+served = time.perf_counter()
+print(imported - start, served - start)
+'''
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    env = dict(os.environ)
+    env['DATABASE_URL'] = f'sqlite:///{tempfile.mkdtemp()}/startup.db'
+    env['PYTHONDONTWRITEBYTECODE'] = ''
+
+    # Create the schema once, outside the timed runs
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'run.py', 'init-db'],
+                   cwd=ROOT, env=env, check=True, capture_output=True)
+
+    imports, firsts, totals = [], [], []
+    for _ in range(runs):
+        started = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', CHILD], cwd=ROOT, env=env,
+                                check=True, capture_output=True, text=True).stdout
+        totals.append(time.perf_counter() - started)
+        imported, served = map(float, output.split()[-2:])
+        imports.append(imported)
+        firsts.append(served)
+
+    print(f'median of {runs} runs')
+    print(f'import         {statistics.median(imports) * 1000:7.1f} ms')
+    print(f'first request  {statistics.median(firsts) * 1000:7.1f} ms')
+    print(f'process        {statistics.median(totals) * 1000:7.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,11 @@
-from app import create_app
+from app import create_app, init_db
 
 
 # Create Flask application
 app = create_app()
 
 if __name__ == '__main__':
+    # Development server: make sure the schema exists (deployments run `flask init-db`)
+    with app.app_context():
+        init_db()
     app.run(debug=True, host='0.0.0.0', port=5001)
\ No newline at end of file
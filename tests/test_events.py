@@ -0,0 +1,55 @@
+import threading
+from datetime import datetime, timedelta
+
+from app.models import db, Organization, QueueItem, QueueEvent, ServiceDailyStats, StaffHourlyStats, User
+from app.events import DailyStatsProjection, StaffStatsProjection, catch_up, _backfill
+
+
+def test_backfilled_skip_follows_the_call(app, service_id):
+    created = datetime(2026, 3, 2, 9, 0)
+    with app.app_context():
+        org_id = Organization.query.first().id
+        staff_id = User.query.filter_by(username='desk1').first().id
+        item = QueueItem(queue_number='CON001', service_id=service_id, phone_number='0788000000',
+                         status='skipped', created_at=created, called_at=created + timedelta(minutes=5),
+                         served_by=staff_id)
+        db.session.add(item)
+        db.session.flush()
+        _backfill(item, org_id)
+        db.session.commit()
+
+        history = [(e.from_status, e.to_status) for e in QueueEvent.query.order_by(QueueEvent.seq)]
+        assert history == [(None, 'waiting'), ('waiting', 'serving'), ('serving', 'skipped')]
+
+        catch_up(StaffStatsProjection(), org_id)
+        assert StaffHourlyStats.query.filter_by(user_id=staff_id).one().skipped == 1
+
+
+def test_concurrent_catch_up_applies_each_event_once(app, join):
+    for i in range(20):
+        join(f'07880000{i:02d}')
+    with app.app_context():
+        org_id = Organization.query.first().id
+    barrier = threading.Barrier(2)
+    applied, errors = [], []
+
+    def work():
+        with app.app_context():
+            barrier.wait()
+            try:
+                applied.append(catch_up(DailyStatsProjection(), org_id, batch_size=5))
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=work) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    with app.app_context():
+        # Whatever one worker left behind, a later call picks up
+        applied.append(catch_up(DailyStatsProjection(), org_id))
+        assert sum(applied) == 20
+        assert ServiceDailyStats.query.one().joined == 20
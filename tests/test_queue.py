@@ -0,0 +1,148 @@
+import threading
+from collections import Counter
+
+from app.models import QueueItem, QueueEvent, StaffAction, User
+
+
+def test_join_queue_numbers_tickets(app, join):
+    first = join('0788000001').json
+    second = join('0788000002').json
+
+    assert first['success'] and second['success']
+    assert first['queue_number'] == 'CON001'
+    assert second['queue_number'] == 'CON002'
+    assert second['position'] == 2
+    with app.app_context():
+        assert QueueEvent.query.filter_by(to_status='waiting').count() == 2
+
+
+def test_join_queue_retry_returns_same_ticket(app, join):
+    first = join(idempotency_key='kiosk-1-abc').json
+    retry = join(idempotency_key='kiosk-1-abc').json
+
+    assert retry['duplicate'] is True
+    assert retry['queue_number'] == first['queue_number']
+    with app.app_context():
+        assert QueueItem.query.count() == 1
+
+
+def test_call_next_serves_in_order_and_records_staff(app, join, login):
+    join('0788000001')
+    join('0788000002')
+    desk = login()
+
+    called = desk.post('/staff/api/call-next').json
+    assert called['queue_item']['queue_number'] == 'CON001'
+
+    called = desk.post('/staff/api/call-next').json
+    assert called['queue_item']['queue_number'] == 'CON002'
+
+    with app.app_context():
+        staff_id = User.query.filter_by(username='desk1').first().id
+        statuses = {item.queue_number: (item.status, item.served_by) for item in QueueItem.query}
+    assert statuses == {'CON001': ('done', staff_id), 'CON002': ('serving', staff_id)}
+
+    assert desk.post('/staff/api/call-next').json['success'] is False
+
+
+def test_concurrent_desks_never_call_the_same_ticket(app, join, login):
+    for i in range(8):
+        join(f'078800000{i}')
+    desks = [login('desk1'), login('desk2')]
+    results = []
+
+    def work(desk):
+        for _ in range(4):
+            results.append(desk.post('/staff/api/call-next').json)
+
+    threads = [threading.Thread(target=work, args=(desk,)) for desk in desks]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    called = [r['queue_item']['id'] for r in results if r['success']]
+    assert len(called) == len(set(called)) == 8
+    with app.app_context():
+        calls = Counter(e.queue_item_id for e in QueueEvent.query.filter_by(to_status='serving'))
+    assert set(calls.values()) == {1}
+
+
+def test_staff_action_retry_is_replayed(app, join, login):
+    join('0788000001')
+    join('0788000002')
+    desk = login()
+
+    first = desk.post('/staff/api/call-next', json={'idempotency_key': 'click-1'})
+    retry = desk.post('/staff/api/call-next', json={'idempotency_key': 'click-1'})
+
+    assert retry.headers.get('Idempotent-Replayed') == 'true'
+    assert retry.json == first.json
+    with app.app_context():
+        assert QueueEvent.query.filter_by(to_status='serving').count() == 1
+        assert StaffAction.query.count() == 1
+
+    # The same key from another staff member is refused
+    other = login('desk2').post('/staff/api/call-next', json={'idempotency_key': 'click-1'})
+    assert other.status_code == 422
+
+
+def test_batch_actions_roll_back_together(app, join, login):
+    join('0788000001')
+    join('0788000002')
+    desk = login()
+    serving = desk.post('/staff/api/call-next').json['queue_item']
+
+    failed = desk.post('/staff/api/actions', json={'actions': [
+        {'type': 'done', 'item_id': serving['id']},
+        {'type': 'skip', 'item_id': 9999}
+    ]})
+    assert failed.status_code == 404
+    assert failed.json['index'] == 1
+
+    done = desk.post('/staff/api/actions', json={'actions': [
+        {'type': 'done', 'item_id': serving['id']},
+        {'type': 'call_next'}
+    ]}).json
+    assert done['success'] is True
+    assert done['results'][1]['queue_item']['queue_number'] == 'CON002'
+
+    # A second click on the same ticket is refused instead of counted twice
+    again = desk.post(f"/staff/api/mark-done/{serving['id']}")
+    assert again.status_code == 409
+
+
+def test_join_queue_without_key_never_returns_another_ticket(app, join):
+    join('0788000001')
+    second = join('0788000002').json
+
+    assert 'duplicate' not in second
+    assert second['queue_number'] == 'CON002'
+
+
+def test_join_queue_refuses_oversized_keys(app, client, service_id, join):
+    assert join(idempotency_key='k' * 65).status_code == 400
+
+    batch = client.post('/client/api/join-queue/batch', json={'tickets': [
+        {'service_id': service_id, 'phone_number': '0788000001', 'idempotency_key': 'k' * 65}
+    ]})
+    assert batch.status_code == 400
+    with app.app_context():
+        assert QueueItem.query.count() == 0
+
+
+def test_call_next_reports_busy_when_every_claim_is_lost(app, join, login, monkeypatch):
+    from app.routes import staff
+
+    for i in range(3):
+        join(f'078800000{i}')
+    desk = login()
+    # Another desk takes every ticket between the select and the claim
+    monkeypatch.setattr(staff, 'MAX_CALL_ATTEMPTS', 2)
+    monkeypatch.setattr(staff, '_move', lambda item, from_status, **values: from_status != 'waiting')
+
+    busy = desk.post('/staff/api/call-next', json={'idempotency_key': 'click-1'})
+    assert busy.status_code == 503
+    assert 'message' not in busy.json
+    with app.app_context():
+        assert StaffAction.query.count() == 0
@@ -0,0 +1,79 @@
+import sqlite3
+
+import pytest
+import sqlalchemy as sa
+
+from app.models import db
+from app.replicas import ReplicaRouter
+
+
+def _copy(source, target):
+    """Copy a SQLite database the way a replica would see it; a plain file copy misses the WAL"""
+    src, dst = sqlite3.connect(source), sqlite3.connect(target)
+    src.backup(dst)
+    src.close()
+    dst.close()
+
+
+def test_replica_health_and_failback(app, tmp_path, monkeypatch):
+    with app.app_context():
+        if db.engine.dialect.name != 'sqlite':
+            pytest.skip('uses two SQLite files as primary and replica')
+        primary = db.engine.url.database
+        replica_file = tmp_path / 'replica.db'
+        router = ReplicaRouter([f'sqlite:///{replica_file}'], max_lag=5, check_interval=3600)
+        replica = router.replicas[0]
+
+        # An empty replica has no heartbeat table yet
+        router.check(now=1000)
+        assert not replica.healthy and replica.error == 'OperationalError'
+        assert router.pick() is None
+
+        # Caught up with the heartbeat the last check wrote
+        _copy(primary, replica_file)
+        router.check(now=1001)
+        assert replica.healthy and replica.lag == 0.0
+        assert router.pick() is replica.engine
+
+        # Behind, but within REPLICA_MAX_LAG
+        router.check(now=1004)
+        assert replica.healthy and replica.lag == 4
+        assert router.pick() is replica.engine
+
+        # Too far behind: reads go back to the primary until it catches up
+        router.check(now=1010)
+        assert not replica.healthy and replica.lag == 10 and replica.error is None
+        assert router.pick() is None
+
+        _copy(primary, replica_file)
+        router.check(now=1011)
+        assert replica.healthy
+        assert router.pick() is replica.engine
+
+        # A primary that cannot take the heartbeat leaves no way to measure lag
+        def broken_beat(now):
+            raise sa.exc.OperationalError('UPDATE replica_heartbeat', {}, Exception('down'))
+        monkeypatch.setattr(router, '_beat', broken_beat)
+        router.check(now=1012)
+        assert not replica.healthy and replica.error == 'primary: OperationalError'
+        assert router.pick() is None
+
+        replica.engine.dispose()
+
+
+def test_stale_health_falls_back_to_primary(app, tmp_path):
+    with app.app_context():
+        if db.engine.dialect.name != 'sqlite':
+            pytest.skip('uses two SQLite files as primary and replica')
+        replica_file = tmp_path / 'replica.db'
+        router = ReplicaRouter([f'sqlite:///{replica_file}'], max_lag=5, check_interval=3600)
+        router.check()
+        _copy(db.engine.url.database, replica_file)
+        router.check()
+        assert router.pick() is router.replicas[0].engine
+
+        # The background check stopped reporting
+        router.replicas[0].checked_at -= 4 * 3600
+        assert router.pick() is None
+
+        router.replicas[0].engine.dispose()
@@ -0,0 +1,30 @@
+from app.models import Organization, QueueItem, StaffServiceTimes
+from app.events import PROJECTIONS, catch_up
+from app.routes.super_admin import ORGANIZATION_DATA
+from app.sweeper import sweep_organization
+
+
+def test_deleting_an_organization_removes_its_queue_data(app, join, login):
+    join('0788000001')
+    join('0788000002')
+    desk = login()
+    serving = desk.post('/staff/api/call-next', json={'idempotency_key': 'click-1'}).json['queue_item']
+    desk.post(f"/staff/api/mark-done/{serving['id']}", json={'idempotency_key': 'click-2'})
+    with app.app_context():
+        org = Organization.query.first()
+        for projection in PROJECTIONS:
+            catch_up(projection(), org.id)
+        sweep_organization(org)
+        org_id = org.id
+        assert all(model.query.count() for model in ORGANIZATION_DATA)
+        assert StaffServiceTimes.query.count()
+
+    admin = app.test_client()
+    admin.post('/super-admin/login', json={'username': 'superadmin', 'password': 'admin123'})
+    assert admin.delete(f'/super-admin/api/organizations/{org_id}').json['success'] is True
+
+    with app.app_context():
+        assert QueueItem.query.count() == 0
+        assert StaffServiceTimes.query.count() == 0
+        assert {model.__tablename__: model.query.count() for model in ORGANIZATION_DATA} == \
+            {model.__tablename__: 0 for model in ORGANIZATION_DATA}
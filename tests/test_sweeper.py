@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta
+
+from app.models import db, Organization, QueueItem, QueueEvent, SweepRun
+from app.sweeper import sweep_organization
+
+# A fixed midday in Africa/Kigali (UTC+2), so sweeping an hour later never crosses local midnight
+NOON = datetime(2026, 3, 2, 10, 0)
+
+
+def _ticket(service_id, number, created_at, status='waiting', called_at=None):
+    item = QueueItem(queue_number=number, service_id=service_id, phone_number='0788000000',
+                     status=status, created_at=created_at, called_at=called_at)
+    db.session.add(item)
+    db.session.commit()
+    return item.id
+
+
+def _organization():
+    org = Organization.query.first()
+    org.timezone = 'Africa/Kigali'
+    db.session.commit()
+    return org
+
+
+def test_sweeper_expires_tickets_from_previous_days(app, service_id):
+    now = NOON
+    with app.app_context():
+        old = _ticket(service_id, 'CON001', now - timedelta(days=2))
+        today = _ticket(service_id, 'CON002', now)
+
+        run = sweep_organization(_organization(), now=now)
+
+        assert run.expired == 1
+        assert db.session.get(QueueItem, old).status == 'expired'
+        assert db.session.get(QueueItem, today).status == 'waiting'
+        assert QueueEvent.query.filter_by(queue_item_id=old, to_status='expired').count() == 1
+        assert SweepRun.query.count() == 1
+
+
+def test_no_show_timeout_is_off_by_default(app, service_id):
+    now = NOON
+    with app.app_context():
+        long_visit = _ticket(service_id, 'CON001', now - timedelta(minutes=1), status='serving',
+                             called_at=now - timedelta(minutes=1))
+        run = sweep_organization(_organization(), now=now + timedelta(minutes=45))
+
+        assert run.no_shows == 0
+        assert db.session.get(QueueItem, long_visit).status == 'serving'
+
+
+def test_no_show_timeout_skips_tickets_called_long_ago(app, service_id):
+    app.config['NO_SHOW_TIMEOUT'] = 30
+    now = NOON
+    with app.app_context():
+        no_show = _ticket(service_id, 'CON001', now, status='serving', called_at=now)
+        run = sweep_organization(_organization(), now=now + timedelta(minutes=31))
+
+        assert run.no_shows == 1
+        assert db.session.get(QueueItem, no_show).status == 'skipped'